@@ -8,8 +8,10 @@ Gestisce connessioni, query execution e schema discovery.
 
 from motor.motor_asyncio import AsyncIOMotorClient
 from pymongo.errors import ConnectionFailure
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
+from collections import OrderedDict
 import asyncio
+import time
 
 
 class MongoDBService:
@@ -23,19 +25,32 @@ class MongoDBService:
     - Error handling e cleanup
     """
 
-    def __init__(self, uri: str, database_name: str):
+    def __init__(
+            self,
+            uri: str,
+            database_name: str,
+            schema_cache_size: int = 32,
+            schema_cache_ttl: float = 60.0
+    ):
         """
         Inizializza servizio MongoDB
 
         Args:
             uri: Connection string MongoDB (con auth se necessario)
             database_name: Nome del database da utilizzare
+            schema_cache_size: Collezioni di cui tenere lo schema in cache (LRU)
+            schema_cache_ttl: Secondi dopo cui lo schema di una collezione viene rianalizzato
         """
         self.uri = uri
         self.database_name = database_name
         self.client: AsyncIOMotorClient = None
         self.db = None
 
+        # Schema per collezione: (istante analisi, schema), in ordine LRU
+        self._schema_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._schema_cache_size = schema_cache_size
+        self._schema_cache_ttl = schema_cache_ttl
+
     async def connect(self) -> None:
         """Stabilisce connessione asincrona al database"""
         if not self.client:
@@ -157,6 +172,22 @@ class MongoDBService:
         Raises:
             Exception: Se analisi fallisce
         """
+        # Schema analizzato di recente: niente round-trip a MongoDB
+        cached = self._schema_cache.get(collection)
+        if cached is not None and time.monotonic() - cached[0] < self._schema_cache_ttl:
+            self._schema_cache.move_to_end(collection)
+            return cached[1]
+
+        schema = await self._analyze_collection_schema(collection)
+        if self._schema_cache_size > 0:
+            self._schema_cache[collection] = (time.monotonic(), schema)
+            self._schema_cache.move_to_end(collection)
+            if len(self._schema_cache) > self._schema_cache_size:
+                self._schema_cache.popitem(last=False)
+        return schema
+
+    async def _analyze_collection_schema(self, collection: str) -> Dict[str, Any]:
+        """Campiona la collezione e ne deduce lo schema (senza cache)"""
         await self.connect()
 
         try:
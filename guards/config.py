@@ -13,6 +13,17 @@ DEFAULT_CONFIG = {
     "ollama_url": "http://localhost:11434",
     "ollama_model": "gemma2:2b",  # Fast model for classification
     "llm_timeout": 5.0,
+    # Concurrent classifications are coalesced and sent in parallel; tune the
+    # Ollama server with OLLAMA_NUM_PARALLEL (>= batch size) and OLLAMA_MAX_LOADED_MODELS
+    "llm_batch_window_ms": 10.0,
+    "llm_max_batch_size": 16,
+    # Optional joblib artifact with a distilled TF-IDF + logistic regression
+    # topic classifier; Ollama is the fallback below the confidence threshold
+    "topic_model_path": None,
+    "topic_model_min_confidence": 0.85,
+    # Streamed answers can only be checked after they are sent (log-only);
+    # when enabled, the last 4KB of text is validated in the background
+    "validate_streaming_output": False,
     
     "custom_messages": {
         "toxic": "Non posso elaborare contenuti inappropriati. Ti prego di riformulare.",
@@ -3,30 +3,62 @@ Custom LLM-based Topic Validator using AsyncGuard and httpx
 ======================================================
 """
 
-import json
+import re
+import functools
+import traceback
+import asyncio
 import logging
+import threading
 import httpx
-from typing import Optional, List, Dict, Any
-from guardrails import register_validator
+import orjson
+from collections import OrderedDict
+from typing import Optional, List, Dict
+from guardrails import Guard, register_validator
 from guardrails.validator_base import Validator, FailResult, PassResult, ValidationResult
-from guards.utils import on_fail_exc, on_fail_filter
 
 logger = logging.getLogger(__name__)
 
+# Persistent background loop: the sync validate() API submits classifications
+# here instead of building a fresh event loop per call, and the shared httpx
+# client and coalescing dispatcher all live on this single loop
+_bg_loop = asyncio.new_event_loop()
+threading.Thread(target=_bg_loop.run_forever, name="llm-topic-loop", daemon=True).start()
+
+# Inputs that are nothing but a greeting skip the LLM (matched in full: a
+# greeting or keyword prefix must not let the rest of the request through)
+_ALLOW_RE = re.compile(
+    r"\s*(?:ciao|grazie(?: mille)?|buongiorno|buonasera|salve)[\s!.,]*",
+    re.IGNORECASE
+)
+
 
 @register_validator("custom/llm_topic", data_type="string")
 class LLMTopicValidator(Validator):
     """LLM-based topic validator using Ollama via AsyncGuard and httpx"""
 
+    _CACHE_MAX = 1024  # LRU bound for cached classifications
+    _WINDOW_OVERLAP_CHARS = 200  # text shared by consecutive windows of a long input
+
     def __init__(
         self,
         blocked_topics: Optional[List[str]] = None,
         ollama_url: str = "http://localhost:11434",
         model: str = "gemma3:latest",
         timeout: float = 5.0,
+        min_llm_chars: int = 4,
+        max_llm_chars: int = 2000,
+        batch_window_ms: float = 10.0,
+        max_batch_size: int = 16,
+        local_model_path: Optional[str] = None,
+        local_min_confidence: float = 0.85,
         on_fail: Optional[str] = None
     ):
-        super().__init__(on_fail=on_fail, ollama_url=ollama_url, model=model, timeout=timeout)
+        super().__init__(
+            on_fail=on_fail, ollama_url=ollama_url, model=model, timeout=timeout,
+            min_llm_chars=min_llm_chars, max_llm_chars=max_llm_chars,
+            batch_window_ms=batch_window_ms, max_batch_size=max_batch_size,
+            local_model_path=local_model_path, local_min_confidence=local_min_confidence
+        )
         self.blocked_topics = blocked_topics or [
             "consigli medici personali",
             "opinioni politiche",
@@ -36,15 +68,100 @@ class LLMTopicValidator(Validator):
         self.ollama_url = ollama_url.rstrip("/")
         self.model = model
         self.timeout = timeout
-        self._cache = {}  # Simple cache for performance
+        self.min_llm_chars = min_llm_chars
+        self.max_llm_chars = max_llm_chars
+        self._fast_path_hits = 0
+        self.batch_window_ms = batch_window_ms
+        self.max_batch_size = max_batch_size
+        self._cache: OrderedDict[str, bool] = OrderedDict()  # LRU cache of classifications
+
+        # Optional distilled classifier (TF-IDF + logistic regression), loaded once;
+        # Ollama is only consulted when its confidence is below local_min_confidence
+        self.local_min_confidence = local_min_confidence
+        self._vectorizer = None
+        self._local_model = None
+        if local_model_path:
+            self._load_local_model(local_model_path)
+
+        # Coalescing queue for concurrent classifications (created lazily on the running loop)
+        self._queue: Optional[asyncio.Queue] = None
+        self._dispatcher_task: Optional[asyncio.Task] = None
+        self._batch_tasks: set = set()
+
+        # blocked_topics is fixed at init: materialize the prompt strings once
+        self._blocked_topics_str = ", ".join(self.blocked_topics)
+        self._system_prompt = self._create_system_prompt()
+        self._user_prefix = 'RICHIESTA UTENTE: "'
+        self._user_suffix = '"\n\nCLASSIFICAZIONE:'
+
+        # Pre-serialize the invariant /api/chat JSON around the user text: only the
+        # text itself is encoded per request. The system prompt travels as its own
+        # message, byte-identical across calls, so Ollama can reuse its cached
+        # prompt prefix; keep_alive keeps the classifier loaded and num_ctx is
+        # sized for the short prompt instead of the model's default context.
+        payload_head = orjson.dumps({
+            "model": self.model,
+            "stream": False,
+            "keep_alive": "30m",
+            "options": {
+                "temperature": 0,
+                "num_ctx": 1024,
+                "num_predict": 10,
+                "stop": ["\n", ".", ","]
+            },
+            "messages": [{"role": "system", "content": self._system_prompt}]
+        })
+        self._body_prefix = (
+            payload_head[:-2] + b',{"role":"user","content":' + orjson.dumps(self._user_prefix)[:-1]
+        )
+        self._body_suffix = orjson.dumps(self._user_suffix)[1:] + b"}]}"
+
+        # Shared keep-alive connection pool, reused across classifications on _bg_loop
+        self._client = httpx.AsyncClient(
+            base_url=self.ollama_url,
+            timeout=timeout,
+            headers={"Content-Type": "application/json"},
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64)
+        )
+
+    async def aclose(self) -> None:
+        """Close the shared HTTP client on validator teardown"""
+        await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._client.aclose(), _bg_loop))
+
+    def _is_obviously_safe(self, value: str) -> bool:
+        """Fast path: very short inputs and bare greetings never reach the LLM"""
+        if len(value) < self.min_llm_chars or _ALLOW_RE.fullmatch(value):
+            self._fast_path_hits += 1
+            logger.debug("Topic fast path pass (%d so far): %s...", self._fast_path_hits, value[:50])
+            return True
+        return False
+
+    def _text_windows(self, value: str) -> List[str]:
+        """Texts sent for classification: long inputs are split into overlapping windows, all classified"""
+        if len(value) <= self.max_llm_chars:
+            return [value]
+        overlap = min(self._WINDOW_OVERLAP_CHARS, self.max_llm_chars // 2)
+        step = self.max_llm_chars - overlap
+        return [value[start:start + self.max_llm_chars] for start in range(0, len(value) - overlap, step)]
+
+    async def _classify_windows(self, windows: List[str]) -> bool:
+        """Allowed only if every window is; concurrent windows are coalesced into batches"""
+        results = await asyncio.gather(*(self._classify_with_llm(window) for window in windows))
+        return all(results)
+
+    def _run_llm_sync(self, text: str) -> bool:
+        """Run the async classification on the background loop and wait for it"""
+        windows = self._text_windows(text)
+        future = asyncio.run_coroutine_threadsafe(self._classify_windows(windows), _bg_loop)
+        # Windows beyond one batch may queue behind each other on Ollama
+        batches = -(-len(windows) // self.max_batch_size)
+        return future.result(self.timeout * batches + 1)
     
     def _create_system_prompt(self) -> str:
         """Create system prompt for topic classification"""
-        blocked_str = ", ".join(self.blocked_topics)
-        
         return f"""Sei un classificatore di contenuti. Il tuo compito è determinare se una richiesta utente rientra in topic VIETATI.
 
-TOPIC VIETATI: {blocked_str}
+TOPIC VIETATI: {self._blocked_topics_str}
 
 REGOLE:
 1. Se la richiesta chiede CONSIGLI PERSONALI su salute, medicina, investimenti, politica → VIETATO
@@ -62,179 +179,245 @@ ESEMPI:
 
 Rispondi SOLO con: CONSENTITO oppure VIETATO"""
 
-    def _create_user_prompt(self, user_input: str) -> str:
-        """Create user prompt for classification"""
-        return f"RICHIESTA UTENTE: \"{user_input}\"\n\nCLASSIFICAZIONE:"
+    def _load_local_model(self, path: str) -> None:
+        """Load a joblib artifact ``{"vectorizer": ..., "model": ...}`` (label 1 = CONSENTITO)"""
+        try:
+            import joblib
+        except ImportError:
+            logger.warning("joblib non installato: classificatore locale disabilitato, uso Ollama")
+            return
+        try:
+            artifact = joblib.load(path)
+            self._vectorizer = artifact["vectorizer"]
+            self._local_model = artifact["model"]
+            logger.info("🧠 Classificatore locale caricato da %s", path)
+        except Exception as e:
+            logger.warning("Impossibile caricare il classificatore locale %s: %s", path, e)
+            self._vectorizer = self._local_model = None
+
+    def _classify_locally(self, text: str) -> Optional[bool]:
+        """Return the local decision, or None when it is not confident enough"""
+        if self._local_model is None:
+            return None
+        proba = self._local_model.predict_proba(self._vectorizer.transform([text]))[0]
+        best = proba.argmax()
+        if proba[best] < self.local_min_confidence:
+            return None
+        return self._local_model.classes_[best] == 1
 
     async def _classify_with_llm(self, text: str) -> bool:
-        """Classify text using Ollama LLM via httpx (async)"""
+        """Classify text using Ollama LLM via httpx (async, coalesced)"""
         
         # Check cache first
-        cache_key = text.lower().strip()[:100]
-        if cache_key in self._cache:
-            logger.debug(f"Using cached result for: {text[:50]}...")
-            return self._cache[cache_key]
+        # Keyed on the whole (window-bounded) text: a prefix key would let a
+        # window reuse the verdict of another one that only shares its start
+        cache_key = text.strip().lower()
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            self._cache.move_to_end(cache_key)
+            logger.debug("Using cached result for: %s...", text[:50])
+            return cached
+
+        local = self._classify_locally(text)
+        if local is not None:
+            self._cache[cache_key] = local
+            if len(self._cache) > self._CACHE_MAX:
+                self._cache.popitem(last=False)
+            return local
+        
+        # Hand the request to the dispatcher and wait for its batch to complete
+        self._ensure_dispatcher()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, cache_key, future))
+        return await future
+
+    def _ensure_dispatcher(self) -> None:
+        """Start the dispatcher task on the running loop if it is not active there"""
+        loop = asyncio.get_running_loop()
+        task = self._dispatcher_task
+        if task is None or task.done() or task.get_loop() is not loop:
+            self._queue = asyncio.Queue()
+            self._dispatcher_task = loop.create_task(self._dispatcher())
+
+    async def _dispatcher(self) -> None:
+        """Gather requests arriving within batch_window_ms and dispatch them in parallel"""
+        queue = self._queue
+        loop = asyncio.get_running_loop()
+        window = self.batch_window_ms / 1000
         
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + window
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            
+            # Run the batch without blocking collection of the next one
+            task = loop.create_task(self._run_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _run_batch(self, batch: list) -> None:
+        """Classify a batch concurrently, sending identical texts only once"""
+        waiters: Dict[str, list] = {}
+        texts: Dict[str, str] = {}
+        for text, cache_key, future in batch:
+            waiters.setdefault(cache_key, []).append(future)
+            texts.setdefault(cache_key, text)
+        
+        logger.debug("Dispatching LLM batch: %d requests, %d unique", len(batch), len(texts))
+        results = await asyncio.gather(
+            *(self._request_classification(text, cache_key) for cache_key, text in texts.items())
+        )
+        
+        for cache_key, is_allowed in zip(texts, results):
+            for future in waiters[cache_key]:
+                if not future.done():
+                    future.set_result(is_allowed)
+
+    async def _request_classification(self, text: str, cache_key: str) -> bool:
+        """Send a single classification request to Ollama"""
         try:
-            system_prompt = self._create_system_prompt()
-            user_prompt = self._create_user_prompt(text)
+            body = self._body_prefix + orjson.dumps(text)[1:-1] + self._body_suffix
             
-            payload = {
-                "model": self.model,
-                "prompt": f"{system_prompt}\n\n{user_prompt}",
-                "stream": False,
-                "options": {
-                    "temperature": 0.1,
-                    "num_predict": 10,
-                    "stop": ["\n", ".", ","]
-                }
-            }
+            logger.debug("Making async LLM request for: %s...", text[:50])
             
-            logger.debug(f"Making async LLM request for: {text[:50]}...")
+            response = await self._client.post("/api/chat", content=body)
+            response.raise_for_status()
             
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.post(
-                    f"{self.ollama_url}/api/generate",
-                    json=payload,
-                    headers={"Content-Type": "application/json"}
-                )
-                response.raise_for_status()
-                
-                result = response.json()
-                llm_output = result.get("response", "").strip().upper()
-                
-                # Parse LLM response
-                is_allowed = "CONSENTITO" in llm_output
-                
-                # Cache result (limit cache size)
-                if len(self._cache) < 100:
-                    self._cache[cache_key] = is_allowed
-                
-                logger.info(f"LLM classification for '{text[:50]}...': {llm_output} -> {'ALLOWED' if is_allowed else 'BLOCKED'}")
-                return is_allowed
+            result = orjson.loads(response.content)
+            llm_output = result.get("message", {}).get("content", "").strip().upper()
+            
+            # Parse LLM response
+            is_allowed = "CONSENTITO" in llm_output
+            
+            # Cache result, evicting the least recently used entry
+            self._cache[cache_key] = is_allowed
+            if len(self._cache) > self._CACHE_MAX:
+                self._cache.popitem(last=False)
+            
+            logger.info(
+                "LLM classification for '%s...': %s -> %s",
+                text[:50], llm_output, "ALLOWED" if is_allowed else "BLOCKED"
+            )
+            return is_allowed
                 
         except (httpx.TimeoutException, httpx.RequestError) as e:
-            logger.warning(f"LLM request failed: {e}")
+            logger.warning("LLM request failed: %s", e)
             return True  # Fail-open: allow if LLM unavailable
         except Exception as e:
-            logger.error(f"LLM classification error: {e}")
+            logger.error("LLM classification error: %s", e)
             return True  # Fail-open
     
-    async def validate_async(self, value: str, metadata: Dict) -> ValidationResult:
-        """Async validation using LLM classification"""
+    def _to_result(self, value: str, is_allowed: bool) -> ValidationResult:
+        """Map a classification to the validation result shared by both entry points"""
+        if not is_allowed:
+            logger.info("Topic blocked by LLM: %s...", value[:50])
+            return FailResult(
+                error_message=(
+                    f"Sono un sistema AI per analytics di database. Non posso fornire {self._blocked_topics_str}. "
+                    f"Posso aiutarti con query database, analisi dati e programmazione."
+                ),
+                fix_value=""
+            )
         
-        logger.debug(f"Starting async LLM topic validation for: {value[:50]}...")
+        logger.debug("Topic validation passed by LLM: %s...", value[:50])
+        return PassResult()
+    
+    def _technical_error(self, e: Exception) -> ValidationResult:
+        """Log a technical failure and fail open"""
+        logger.warning("Topic validation technical error: %s", e)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Topic validation traceback: %s", traceback.format_exc())
+        return PassResult()  # Fail-open on technical errors
+    
+    async def async_validate(self, value: str, metadata: Dict) -> ValidationResult:
+        """Async validation, awaited natively by AsyncGuard (no executor thread)"""
+        logger.debug("Starting async LLM topic validation for: %s...", value[:50])
         
-        try:
-            # Use LLM for semantic classification (async)
-            is_allowed = await self._classify_with_llm(value)
-            
-            if not is_allowed:
-                blocked_topics_str = ", ".join(self.blocked_topics)
-                logger.info(f"Topic blocked by LLM: {value[:50]}...")
-                return FailResult(
-                    error_message=(
-                        f"Sono un sistema AI per analytics di database. Non posso fornire {blocked_topics_str}. "
-                        f"Posso aiutarti con query database, analisi dati e programmazione."
-                    )
-                )
-            
-            logger.debug(f"Topic validation passed by LLM: {value[:50]}...")
+        if self._is_obviously_safe(value):
             return PassResult()
-            
+        
+        try:
+            # Use LLM for semantic classification (async, on the shared background loop)
+            is_allowed = await asyncio.wrap_future(
+                asyncio.run_coroutine_threadsafe(self._classify_windows(self._text_windows(value)), _bg_loop)
+            )
         except Exception as e:
-            logger.warning(f"Topic validation technical error: {e}")
-            import traceback
-            logger.debug(f"Topic validation traceback: {traceback.format_exc()}")
-            return PassResult()  # Fail-open on technical errors
+            return self._technical_error(e)
+        
+        return self._to_result(value, is_allowed)
     
     def validate(self, value: str, metadata: dict = None):
-        """Sync validation using requests (fallback for Guard)"""
-        logger.debug(f"Starting sync LLM topic validation for: {value[:50]}...")
+        """Sync validation via the background loop (used by Guard)"""
+        logger.debug("Starting sync LLM topic validation for: %s...", value[:50])
         
-        try:
-            # Use requests for sync validation
-            import requests
-            
-            # Check cache first
-            cache_key = value.lower().strip()[:100]
-            if cache_key in self._cache:
-                logger.debug(f"Using cached result for: {value[:50]}...")
-                is_allowed = self._cache[cache_key]
-            else:
-                # Sync LLM call with requests
-                system_prompt = self._create_system_prompt()
-                user_prompt = self._create_user_prompt(value)
-                
-                payload = {
-                    "model": self.model,
-                    "prompt": f"{system_prompt}\n\n{user_prompt}",
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.1,
-                        "num_predict": 10,
-                        "stop": ["\n", ".", ","]
-                    }
-                }
-                
-                logger.debug(f"Making sync LLM request for: {value[:50]}...")
-                
-                response = requests.post(
-                    f"{self.ollama_url}/api/generate",
-                    json=payload,
-                    headers={"Content-Type": "application/json"},
-                    timeout=self.timeout
-                )
-                response.raise_for_status()
-                
-                result = response.json()
-                llm_output = result.get("response", "").strip().upper()
-                is_allowed = "CONSENTITO" in llm_output
-                
-                # Cache result
-                if len(self._cache) < 100:
-                    self._cache[cache_key] = is_allowed
-                
-                logger.info(f"LLM classification for '{value[:50]}...': {llm_output} -> {'ALLOWED' if is_allowed else 'BLOCKED'}")
-            
-            if not is_allowed:
-                blocked_topics_str = ", ".join(self.blocked_topics)
-                logger.info(f"Topic blocked by LLM (sync): {value[:50]}...")
-                return FailResult(
-                    error_message=(
-                        f"Sono un sistema AI per analytics di database. Non posso fornire {blocked_topics_str}. "
-                        f"Posso aiutarti con query database, analisi dati e programmazione."
-                    ),
-                    fix_value=""
-                )
-            
-            logger.debug(f"Topic validation passed by LLM (sync): {value[:50]}...")
+        if self._is_obviously_safe(value):
             return PassResult()
-            
+        
+        try:
+            is_allowed = self._run_llm_sync(value)
         except Exception as e:
-            logger.warning(f"Sync topic validation technical error: {e}")
-            import traceback
-            logger.debug(f"Sync topic validation traceback: {traceback.format_exc()}")
-            return PassResult()  # Fail-open on technical errors
+            return self._technical_error(e)
+        
+        return self._to_result(value, is_allowed)
+
+
+@functools.lru_cache(maxsize=8)
+def _cached_topic_validator(
+    batch_window_ms: float,
+    max_batch_size: int,
+    local_model_path: Optional[str],
+    local_min_confidence: float
+) -> LLMTopicValidator:
+    """Build the topic validator once per distinct settings; exceptions are not cached"""
+    logger.info("🔧 Creating LLMTopicValidator...")
+    return LLMTopicValidator(
+        batch_window_ms=batch_window_ms,
+        max_batch_size=max_batch_size,
+        local_model_path=local_model_path,
+        local_min_confidence=local_min_confidence,
+        on_fail="exception"
+    )
 
 
+def create_topic_validator(config: dict) -> LLMTopicValidator:
+    """
+    Shared dual-mode LLM topic validator for the given configuration.
+
+    The validator (with its classification cache and HTTP client) is reused
+    across calls with the same topic settings, so the input guard and
+    add_topic_restriction share a single instance.
+
+    Concurrent classifications are coalesced within ``llm_batch_window_ms`` and
+    dispatched in parallel (up to ``llm_max_batch_size`` per batch). Ollama only
+    serves them concurrently if the server is started with
+    ``OLLAMA_NUM_PARALLEL`` >= the batch size; ``OLLAMA_MAX_LOADED_MODELS``
+    controls how many models stay resident alongside the chat model.
+    """
+    # Only the hashable settings the validator uses form the cache key
+    return _cached_topic_validator(
+        config.get("llm_batch_window_ms", 10.0),
+        config.get("llm_max_batch_size", 16),
+        config.get("topic_model_path"),
+        config.get("topic_model_min_confidence", 0.85)
+    )
 
-from guardrails import Guard
 
 def add_topic_restriction(config: dict) -> Guard:
-    """Add topic restriction to Guard using dual-mode LLM validator"""
+    """Add topic restriction to Guard using the shared dual-mode LLM validator"""
     try:
-        logger.info("🔧 Creating LLMTopicValidator for Guard...")
-        validator = LLMTopicValidator(on_fail="exception")
-        logger.info(f"🔧 Created validator: {type(validator).__name__}")
-        
-        guard = Guard().use(validator)
-        logger.info(f"🔧 Guard created with {len(guard.validators)} validators")
+        guard = Guard().use(create_topic_validator(config))
+        logger.info("🔧 Guard created with %d validators", len(guard.validators))
         logger.info("Using dual-mode LLM-based topic validator (sync + async)")
         return guard
         
     except Exception as e:
-        logger.error(f"LLM topic validator failed: {e}")
-        import traceback
-        logger.error(f"Traceback: {traceback.format_exc()}")
+        logger.error("LLM topic validator failed: %s", e)
+        logger.error("Traceback: %s", traceback.format_exc())
         return Guard()  # Empty guard as fallback
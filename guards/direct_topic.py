@@ -3,13 +3,87 @@ Custom Topic Validator - Direct Guardrails Integration
 =====================================================
 """
 
+import re
 import logging
+import threading
+import traceback
+from typing import List, Optional, Tuple
 from guardrails import Guard
 from guardrails.validator_base import Validator
 from guardrails.errors import ValidationError
 
 logger = logging.getLogger(__name__)
 
+# Blocked keyword patterns and the topic category they belong to
+_PATTERNS: Tuple[Tuple[str, str], ...] = (
+    ("suggerisci", "consigli medici personali"),
+    ("consigli per", "consigli medici personali"),
+    ("rimedio", "consigli medici personali"),
+    ("cura per", "consigli medici personali"),
+    ("mal di", "consigli medici personali"),
+    ("cosa prendo", "consigli medici personali"),
+    ("farmaco", "consigli medici personali"),
+    ("medicina", "consigli medici personali"),
+)
+
+# Data-analysis keywords that exempt a text from the block
+_ANALYSIS: Tuple[str, ...] = ("analisi", "dati", "database", "query")
+
+# Compiled once at import and shared by every validator instance;
+# the named group of a match indexes back into _PATTERNS.
+# Case-insensitive so callers never need a lowercased copy of the input
+_KEYWORD_RE = re.compile(
+    "|".join(f"(?P<g{i}>{re.escape(p)})" for i, (p, _) in enumerate(_PATTERNS)),
+    re.IGNORECASE
+)
+_ANALYSIS_RE = re.compile("|".join(map(re.escape, _ANALYSIS)), re.IGNORECASE)
+
+# Optional Hyperscan multi-pattern DFA for high-QPS deployments; the regexes
+# above remain the fallback when the library is not installed
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+_ANALYSIS_ID = len(_PATTERNS)  # every analysis keyword reports this id
+_HS_DB = None
+_hs_local = threading.local()  # Hyperscan scratch space is per thread
+
+if hyperscan is not None:
+    try:
+        _expressions = [re.escape(p).encode() for p, _ in _PATTERNS]
+        _expressions += [k.encode() for k in _ANALYSIS]
+        _HS_DB = hyperscan.Database()
+        _HS_DB.compile(
+            expressions=_expressions,
+            ids=list(range(len(_PATTERNS))) + [_ANALYSIS_ID] * len(_ANALYSIS),
+            flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SINGLEMATCH] * len(_expressions),
+        )
+        logger.info("⚡ Hyperscan attivo per il controllo keyword dei topic")
+    except Exception as e:
+        logger.warning("Hyperscan non disponibile, uso re: %s", e)
+        _HS_DB = None
+
+
+def _hs_keyword_check(text: str) -> Optional[str]:
+    """Hyperscan variant of the keyword check: one pass over the UTF-8 bytes"""
+    scratch = getattr(_hs_local, "scratch", None)
+    if scratch is None:
+        scratch = _hs_local.scratch = hyperscan.Scratch(_HS_DB)
+    found = []
+
+    def on_match(pattern_id, start, end, flags, context):
+        found.append(pattern_id)
+        return pattern_id == _ANALYSIS_ID  # non-zero stops the scan
+
+    try:
+        _HS_DB.scan(text.encode("utf-8"), match_event_handler=on_match, scratch=scratch)
+    except hyperscan.ScanTerminated:
+        pass  # stopped by on_match at an analysis keyword
+    if not found or found[-1] == _ANALYSIS_ID:
+        return None
+    return _PATTERNS[found[0]][1]
+
 class DirectTopicValidator(Validator):
     """Direct topic validator without @register_validator decorator"""
     
@@ -17,39 +91,43 @@ class DirectTopicValidator(Validator):
         # Initialize parent without using register_validator
         super().__init__(on_fail=on_fail, **kwargs)
         self.rail_alias = "custom_topic"  # Set rail_alias directly
+
+    def _quick_keyword_check(self, text: str) -> Optional[str]:
+        """Return the blocked category matched by text (case-insensitive), if any"""
+        if _HS_DB is not None:
+            return _hs_keyword_check(text)
+        match = _KEYWORD_RE.search(text)
+        if match is None:
+            return None
+        # Skip if it's data analysis
+        if _ANALYSIS_RE.search(text) is not None:
+            return None
+        return _PATTERNS[int(match.lastgroup[1:])][1]
+
+    def batch_validate(self, texts: List[str]) -> List[Optional[str]]:
+        """Scan many texts in one tight loop; returns the blocked category per text"""
+        check = self._quick_keyword_check
+        return [check(text) if isinstance(text, str) else None for text in texts]
     
     def validate(self, value, metadata=None):
         """Direct validation method"""
-        logger.info(f"🔥 DirectTopicValidator.validate() called with value type: {type(value)}")
-        logger.info(f"🔥 DirectTopicValidator.validate() value: '{str(value)[:100]}...'")
+        logger.info("🔥 DirectTopicValidator.validate() called with value type: %s", type(value))
+        logger.info("🔥 DirectTopicValidator.validate() value: '%s...'", str(value)[:100])
         
         if not isinstance(value, str):
-            logger.warning(f"⚠️ DirectTopicValidator received non-string: {type(value)}")
+            logger.warning("⚠️ DirectTopicValidator received non-string: %s", type(value))
             return value
             
-        text_lower = value.lower()
-        
-        # Medical advice patterns
-        medical_patterns = [
-            "suggerisci", "consigli per", "rimedio", "cura per",
-            "mal di", "cosa prendo", "farmaco", "medicina"
-        ]
-        
         # Check for medical advice
-        for pattern in medical_patterns:
-            if pattern in text_lower:
-                # Skip if it's data analysis
-                if any(word in text_lower for word in ["analisi", "dati", "database", "query"]):
-                    continue
-                    
-                logger.info(f"🚫 Topic restriction triggered: medical advice detected")
-                raise ValidationError(
-                    "Sono un sistema AI per database analytics. "
-                    "Non posso fornire consigli medici personali. "
-                    "Posso aiutarti con query database e analisi dati."
-                )
+        if self._quick_keyword_check(value):
+            logger.info("🚫 Topic restriction triggered: medical advice detected")
+            raise ValidationError(
+                "Sono un sistema AI per database analytics. "
+                "Non posso fornire consigli medici personali. "
+                "Posso aiutarti con query database e analisi dati."
+            )
         
-        logger.debug(f"✅ Topic validation passed for: {value[:50]}...")
+        logger.debug("✅ Topic validation passed for: %s...", value[:50])
         return value
     
     def to_dict(self):
@@ -65,16 +143,15 @@ def create_topic_guard() -> Guard:
     try:
         logger.info("🔨 Creating DirectTopicValidator...")
         validator = DirectTopicValidator(on_fail="exception")
-        logger.info(f"🔨 DirectTopicValidator created: {type(validator).__name__}")
-        logger.info(f"🔨 Validator rail_alias: {getattr(validator, 'rail_alias', 'no_alias')}")
-        logger.info(f"🔨 Validator on_fail: {getattr(validator, 'on_fail', 'unknown')}")
+        logger.info("🔨 DirectTopicValidator created: %s", type(validator).__name__)
+        logger.info("🔨 Validator rail_alias: %s", getattr(validator, "rail_alias", "no_alias"))
+        logger.info("🔨 Validator on_fail: %s", getattr(validator, "on_fail", "unknown"))
         
         guard = Guard().use(validator)
-        logger.info(f"🔨 Guard created with {len(guard.validators)} validators")
+        logger.info("🔨 Guard created with %d validators", len(guard.validators))
         logger.info("✅ Direct topic validator created successfully")
         return guard
     except Exception as e:
-        logger.error(f"❌ Direct topic validator failed: {e}")
-        import traceback
-        logger.error(f"Traceback: {traceback.format_exc()}")
+        logger.error("❌ Direct topic validator failed: %s", e)
+        logger.error("Traceback: %s", traceback.format_exc())
         return Guard()  # Empty guard fallback
@@ -5,13 +5,74 @@ Custom Italian PII Validator using spaCy
 
 import re
 import logging
-from typing import List, Optional
-from guardrails import register_validator
+from typing import Iterator, List, Match, Optional
+from guardrails import OnFailAction, register_validator
 from guardrails.validator_base import Validator, FailResult, PassResult
-from guards.utils import on_fail_exc, on_fail_filter
+from guards.utils import on_fail_exc
 
 logger = logging.getLogger(__name__)
 
+# (group name, label, pattern) for each PII type, in reporting order.
+# Possessive quantifiers (?+, ++, {m,n}+) are used wherever giving characters
+# back could never produce a match, so failing inputs do not backtrack;
+# the phone prefix and the area-code digits stay greedy because they can
+# legitimately be re-split between alternatives
+_PII_PATTERNS = (
+    # Italian fiscal code
+    ("cf", "codice fiscale",
+     r'\b[A-Z]{6}[0-9]{2}[A-Z][0-9]{2}[A-Z][0-9]{3}[A-Z]\b'),
+    # Email
+    ("email", "email",
+     r'\b[A-Za-z0-9._%+-]++@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}+\b'),
+    # Italian phone
+    ("phone", "telefono",
+     r'\b(?:\+39|0039)?[\s\-]?+3[0-9]{2}[\s\-]?+[0-9]{6,7}+\b|'
+     r'\b(?:\+39|0039)?[\s\-]?+0[0-9]{2,3}[\s\-]?+[0-9]{6,8}+\b'),
+    # Credit card
+    ("card", "carta di credito",
+     r'\b(?:[0-9]{4}[\s\-]?+){3}[0-9]{4}\b'),
+    # IBAN
+    ("iban", "IBAN",
+     r'\bIT[0-9]{2}\s?+[A-Z][0-9]{3}(?>\s?[0-9]{4}){3}\s?+[0-9]{3}\b'),
+)
+
+# Single alternation scanned once per input; lastgroup names the PII type.
+# Unicode \s on purpose: pasted numbers are often split by non-breaking
+# spaces (U+00A0, U+202F)
+_PII_RE = re.compile(
+    "|".join(f"(?P<{name}>{pattern})" for name, _, pattern in _PII_PATTERNS)
+)
+_PII_LABELS = {name: label for name, label, _ in _PII_PATTERNS}
+
+# Every pattern needs an ASCII digit except email, which needs '@'
+_HAS_DIGIT = re.compile(r'[0-9]').search
+
+# The shortest possible match is an email like "a@b.it" (6 chars)
+_MIN_PII_CHARS = 6
+# Long inputs are scanned in overlapping windows so a pathological input
+# costs O(n * window) instead of growing quadratically; the overlap is wider
+# than any realistic PII token, so matches crossing a window edge are kept
+_SCAN_WINDOW = 4096
+_SCAN_OVERLAP = 256
+
+
+def _iter_pii_matches(value: str) -> Iterator[Match[str]]:
+    """
+    PII matches in value, scanning long inputs window by window. The window
+    end acts as an end of string (\b matches there), so a match touching it
+    is only kept at the real end of value: otherwise it may be a cut-off
+    token, and the next window (which overlaps) sees it whole
+    """
+    n = len(value)
+    if n <= _SCAN_WINDOW:
+        yield from _PII_RE.finditer(value)
+        return
+    for start in range(0, n, _SCAN_WINDOW - _SCAN_OVERLAP):
+        end = start + _SCAN_WINDOW
+        for match in _PII_RE.finditer(value, start, end):
+            if match.end() < end or end >= n:
+                yield match
+
 @register_validator("custom/italian_pii", data_type="string")
 class ItalianPIIValidator(Validator):
     """Custom PII validator with Italian support using regex patterns"""
@@ -19,67 +80,44 @@ class ItalianPIIValidator(Validator):
 
     def __init__(self, on_fail=on_fail_exc):
         super().__init__(on_fail=on_fail)
-        
-        # Italian fiscal code pattern
-        self.fiscal_code_pattern = re.compile(
-            r'\b[A-Z]{6}[0-9]{2}[A-Z][0-9]{2}[A-Z][0-9]{3}[A-Z]\b'
-        )
-        
-        # Email pattern
-        self.email_pattern = re.compile(
-            r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
-        )
-        
-        # Italian phone pattern
-        self.phone_pattern = re.compile(
-            r'\b(?:\+39|0039)?[\s\-]?3[0-9]{2}[\s\-]?[0-9]{6,7}\b|'
-            r'\b(?:\+39|0039)?[\s\-]?0[0-9]{2,3}[\s\-]?[0-9]{6,8}\b'
-        )
-        
-        # Credit card pattern
-        self.credit_card_pattern = re.compile(
-            r'\b(?:[0-9]{4}[\s\-]?){3}[0-9]{4}\b'
-        )
-        
-        # IBAN pattern 
-        self.iban_pattern = re.compile(
-            r'\bIT[0-9]{2}[\s]?[A-Z][0-9]{3}[\s]?[0-9]{4}[\s]?[0-9]{4}[\s]?[0-9]{4}[\s]?[0-9]{3}\b'
-        )
+        # With on_fail="exception" the type list is never shown to the user:
+        # stop at the first hit instead of collecting every PII type
+        self.report_all_types = self.on_fail_descriptor != OnFailAction.EXCEPTION
     
     def validate(self, value: str, metadata: dict = None):
         """Validate for Italian PII patterns"""
         
-        detected_pii = []
-        
-        # Check fiscal code
-        if self.fiscal_code_pattern.search(value):
-            detected_pii.append("codice fiscale")
+        # Cheap prefilters: most chat inputs cannot match any pattern
+        n = len(value)
+        if n < _MIN_PII_CHARS or ("@" not in value and _HAS_DIGIT(value) is None):
+            return PassResult()
         
-        # Check email
-        if self.email_pattern.search(value):
-            detected_pii.append("email")
+        if not self.report_all_types:
+            found = self._first_pii_type(value)
+            if found is None:
+                return PassResult()
+            return self._fail(_PII_LABELS[found])
         
-        # Check phone
-        if self.phone_pattern.search(value):
-            detected_pii.append("telefono")
-        
-        # Check credit card
-        if self.credit_card_pattern.search(value):
-            detected_pii.append("carta di credito")
-        
-        # Check IBAN
-        if self.iban_pattern.search(value):
-            detected_pii.append("IBAN")
+        # One pass over the input collects every PII type present
+        found = {match.lastgroup for match in _iter_pii_matches(value)}
+        detected_pii = [label for name, label in _PII_LABELS.items() if name in found]
         
         if detected_pii:
-            pii_types = ", ".join(detected_pii)
-            return FailResult(
-                error_message=(
-                    f"Rilevati dati personali sensibili: {pii_types}. "
-                    f"Per motivi di sicurezza e privacy, non posso elaborare "
-                    f"informazioni personali identificabili."
-                ),
-                fix_value=""
-            )
+            return self._fail(", ".join(detected_pii))
         
         return PassResult()
+
+    def _first_pii_type(self, value: str) -> Optional[str]:
+        """Group name of the first PII match, scanning long inputs window by window"""
+        return next((match.lastgroup for match in _iter_pii_matches(value)), None)
+
+    def _fail(self, pii_types: str) -> FailResult:
+        """FailResult listing the detected PII types"""
+        return FailResult(
+            error_message=(
+                f"Rilevati dati personali sensibili: {pii_types}. "
+                f"Per motivi di sicurezza e privacy, non posso elaborare "
+                f"informazioni personali identificabili."
+            ),
+            fix_value=""
+        )
@@ -1,19 +1,50 @@
+import re
+import functools
+from typing import Optional
+
+import orjson
+
+from .config import DEFAULT_CONFIG
+
+# Fallback texts when the config does not override a message key; the
+# defaults live in one place, DEFAULT_CONFIG["custom_messages"]
+_DEFAULT_MESSAGES = DEFAULT_CONFIG["custom_messages"]
+
+# Validator keywords sit in the first part of the error (after guardrails'
+# "Validation failed for field ..." preamble). Both the message key and the
+# middleware's violation_type are read from this same span, which also
+# bounds the cache key
+ERROR_SPAN_CHARS = 1024
+
+# Message keys in order of priority (first one found wins)
+_KEY_PRIORITY = ("pii", "topic", "toxic", "profanity")
+
+# All validator keywords in one alternation; the named group is the message key.
+# PII phrases are matched case-sensitively, the rest case-insensitively
+_KEYWORD_RE = re.compile(
+    r"(?P<pii>dati personali sensibili|informazioni personali identificabili)"
+    r"|(?i:(?P<topic>sistema ai per analytics|non posso fornire)"
+    r"|(?P<toxic>toxic)"
+    r"|(?P<profanity>profanity))"
+)
+
+@functools.lru_cache(maxsize=256)
+def _message_key(error_span: str) -> Optional[str]:
+    """Highest-priority message key found in error_span (validators emit stable strings)"""
+    found = {match.lastgroup for match in _KEYWORD_RE.finditer(error_span)}
+    # Check for specific validator messages (in order of priority)
+    return next((k for k in _KEY_PRIORITY if k in found), None)
+
+def error_span(error_msg: str) -> str:
+    """Part of a validator error used to classify the violation"""
+    return error_msg[:ERROR_SPAN_CHARS]
+
 def get_violation_message(error_msg: str, config: dict) -> str:
     """Get appropriate violation message based on error"""
-    error_lower = error_msg.lower()
-    messages = config.get("custom_messages", {})
-    
-    # Check for specific validator messages (in order of priority)
-    if "dati personali sensibili" in error_msg or "informazioni personali identificabili" in error_msg:
-        return messages.get("pii", "Ho rilevato dati personali sensibili nella tua richiesta (nomi, email, codici fiscali, ecc.). Per motivi di sicurezza e privacy, non posso elaborare informazioni personali identificabili.")
-    elif "sistema ai per analytics" in error_lower or "non posso fornire" in error_lower:
-        return messages.get("topic", "Sono un sistema AI per database analytics. Non posso fornire consigli personali.")
-    elif "toxic" in error_lower:
-        return messages.get("toxic", "Non posso elaborare contenuti inappropriati. Ti prego di riformulare.")
-    elif "profanity" in error_lower:
-        return messages.get("profanity", "Linguaggio inappropriato rimosso dalla richiesta.")
-    else:
+    key = _message_key(error_span(error_msg))
+    if key is None:
         return "Validazione fallita. Riprova con contenuto diverso."
+    return config.get("custom_messages", {}).get(key, _DEFAULT_MESSAGES[key])
 
 def create_response_body(message: str, violation_type: str = "content_violation") -> dict:
     """Create standardized error response"""
@@ -21,4 +52,9 @@ def create_response_body(message: str, violation_type: str = "content_violation"
         "error": "Content validation failed",
         "message": message,
         "violation_type": violation_type
-    }
\ No newline at end of file
+    }
+
+@functools.lru_cache(maxsize=64)
+def serialize_violation(message: str, violation_type: str = "content_violation") -> bytes:
+    """JSON bytes of the error response; violation bodies repeat, so they are cached"""
+    return orjson.dumps(create_response_body(message, violation_type))
\ No newline at end of file
@@ -3,220 +3,401 @@ Guardrails Middleware - Improved async and stream handling
 ========================================================
 """
 
-import json
+import re
+import asyncio
 import logging
+import orjson
 from fastapi import Request, Response
-from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import StreamingResponse
-from typing import Optional, Callable, Awaitable, AsyncGenerator
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from typing import Dict, Hashable, List, Optional, Tuple
 
-from guardrails import Guard
+from guardrails import AsyncGuard
 
 from .config import load_config, PROTECTED_ENDPOINTS
 from .validators import create_input_guard, create_output_guard
-from .custom import add_topic_restriction
-from .messages import get_violation_message, create_response_body
-from .utils import extract_query_from_request, extract_content_from_response, should_validate_input
+from .messages import get_violation_message, create_response_body, serialize_violation, error_span
+from .utils import extract_query_from_request, extract_content_from_response, compile_endpoint_matcher, freeze_config
 
 logger = logging.getLogger(__name__)
 
-class GuardrailsMiddleware(BaseHTTPMiddleware):
-    """Guardrails Middleware with improved async/stream handling"""
+# Linee SSE "data: {...}": solo gli eventi con payload oggetto JSON contengono testo
+_SSE_DATA_RE = re.compile(rb'^data: (\{[^\n]*)', re.MULTILINE)
+
+# Query banali (saluti, conferme) che non richiedono i validator
+_TRIVIAL_QUERY_RE = re.compile(r'(?:hi|ciao|ok|si|sì|no|grazie|thanks)\W*', re.IGNORECASE)
+_MIN_QUERY_CHARS = 3
+
+# Tipo di violazione dal messaggio d'errore del validator, in un solo passaggio
+_VIOLATION_RE = re.compile(
+    r"(?P<pii_violation>dati personali sensibili)"
+    r"|(?P<topic_violation>sistema AI per analytics)"
+    r"|(?i:(?P<toxic_violation>toxic))"
+)
+# Validator per tipo, in ordine di priorità (il primo trovato vince)
+_VIOLATION_VALIDATORS = {
+    "pii_violation": "ItalianPIIValidator",
+    "topic_violation": "LLMTopicValidator",
+    "toxic_violation": "ToxicLanguage",
+}
+
+# Oltre questa dimensione una risposta JSON non viene più trattenuta per la
+# validazione: i chunk bufferizzati sono inoltrati e il resto passa in streaming
+MAX_VALIDATE_BYTES = 64 * 1024
+
+# Lo stream è già inviato quando viene validato: basta la coda del testo
+_STREAM_TAIL_CHARS = 4096
+
+class _SSETextCollector:
+    """Estrae incrementalmente il testo dagli eventi SSE di uno stream in uscita"""
+
+    def __init__(self):
+        self.stream_bytes = 0
+        # Linea SSE incompleta tra un chunk e l'altro. Si lavora in bytes:
+        # lo split su b'\n' non spezza mai un carattere UTF-8 multibyte
+        # e orjson decodifica direttamente i bytes
+        self.pending_line = b""
+        self.text_parts: List[str] = []
+        self.text_chars = 0
+        self.complete = False
+
+    def feed(self, chunk: bytes) -> None:
+        """Estrai il testo dagli eventi SSE man mano che arrivano"""
+        self.stream_bytes += len(chunk)
+        if self.complete:
+            return
+        buffer = self.pending_line + chunk
+        cut = buffer.rfind(b'\n') + 1
+        self.pending_line = buffer[cut:]
+        parts_before = len(self.text_parts)
+        self.complete = self._extract_content_from_sse_stream(buffer[:cut])
+        self.text_chars += sum(map(len, self.text_parts[parts_before:]))
+        # Conserva solo la coda del testo (memoria limitata)
+        if self.text_chars > 2 * _STREAM_TAIL_CHARS:
+            self.text_parts[:] = ["".join(self.text_parts)[-_STREAM_TAIL_CHARS:]]
+            self.text_chars = _STREAM_TAIL_CHARS
+
+    def finish(self) -> str:
+        """Coda del testo estratto a fine stream"""
+        if not self.complete and self.pending_line:
+            self._extract_content_from_sse_stream(self.pending_line)
+        return "".join(self.text_parts)[-_STREAM_TAIL_CHARS:]
+
+    def _extract_content_from_sse_stream(self, sse_content: bytes) -> bool:
+        """
+        Estrae il contenuto testuale da un blocco di linee SSE complete in text_parts.
+        Ritorna True sull'evento "complete" con final_content (fine estrazione).
+        """
+        for match in _SSE_DATA_RE.finditer(sse_content):
+            if self._extract_content_from_sse_event(match.group(1)):
+                return True
+        return False
 
-    def __init__(self, app):
-        super().__init__(app)
+    def _extract_content_from_sse_event(self, payload: bytes) -> bool:
+        """Accumula il testo di un singolo evento SSE; True se è l'evento finale"""
+        try:
+            event_data = orjson.loads(payload)
+            
+            # Accumula contenuto finale o chunks
+            if event_data.get("type") == "complete":
+                final_content = event_data.get("final_content", "")
+                if final_content:
+                    self.text_parts.append(final_content)
+                    return True  # Usa solo contenuto finale se disponibile
+            elif event_data.get("type") == "content":
+                self.text_parts.append(event_data.get("chunk", ""))
+                
+        except orjson.JSONDecodeError:
+            pass  # Skip linee malformate
+        except Exception as e:
+            logger.warning("Failed to extract content from SSE stream: %s", e)
+        
+        return False
+
+
+def _is_json_media_type(content_type: str) -> bool:
+    """Stessa regola di FastAPI: application/json o application/*+json, case-insensitive"""
+    maintype, _, subtype = content_type.split(";", 1)[0].strip().lower().partition("/")
+    return maintype == "application" and (subtype == "json" or subtype.endswith("+json"))
+
+
+def _replay_receive(body: bytes, receive: Receive) -> Receive:
+    """receive che restituisce il body già letto, poi delega (es. http.disconnect)"""
+    body_sent = False
+
+    async def replay() -> Message:
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+
+    return replay
+
+
+# Guard già costruiti per configurazione: i validator (modelli HF, client LLM)
+# vengono creati una sola volta per processo anche se il middleware è ricreato
+_GUARDS_CACHE: Dict[Hashable, Tuple[AsyncGuard, AsyncGuard]] = {}
+
+def _build_guards(config: dict) -> Tuple[AsyncGuard, AsyncGuard]:
+    """Return (input_guard, output_guard) for config, building them on first use"""
+    key = freeze_config(config)
+    guards = _GUARDS_CACHE.get(key)
+    if guards is not None:
+        logger.info("♻️ Reusing guards built for this configuration")
+        return guards
+    
+    # Topic restriction is added by create_input_guard at construction time
+    input_guard = create_input_guard(config)
+    output_guard = create_output_guard(config)
+    logger.info(
+        "🛡️ Guards created: input_validators=%d",
+        len(input_guard.validators) if hasattr(input_guard, 'validators') else 0
+    )
+    
+    guards = _GUARDS_CACHE[key] = (input_guard, output_guard)
+    return guards
+
+
+class GuardrailsMiddleware:
+    """
+    Guardrails Middleware as pure ASGI: only protected endpoints pay for
+    validation, and responses are inspected by wrapping ``send``
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
         logger.info("🚀 GuardrailsMiddleware __init__ started")
         
         self.config = load_config()
-        logger.info(f"📋 Config loaded: topic_restriction={self.config.get('enable_topic_restriction')}, pii_detection={self.config.get('enable_pii_detection')}")
+        logger.info(
+            "📋 Config loaded: topic_restriction=%s, pii_detection=%s",
+            self.config.get('enable_topic_restriction'), self.config.get('enable_pii_detection')
+        )
         
-        # Create base guards
-        self.input_guard = create_input_guard(self.config)
-        self.output_guard = create_output_guard(self.config)
-        logger.info(f"🛡️ Base guards created: input_validators={len(self.input_guard.validators) if hasattr(self.input_guard, 'validators') else 0}")
-        
-        # Add topic restriction if enabled
-        if self.config.get("enable_topic_restriction", False):
-            logger.info("🔄 Attempting to add topic restriction...")
-            try:
-                topic_guard = add_topic_restriction(self.config)
-                if topic_guard and hasattr(topic_guard, 'validators') and topic_guard.validators:
-                    all_validators = list(self.input_guard.validators) + list(topic_guard.validators)
-                    self.input_guard = Guard().use_many(*all_validators)
-                    logger.info(f"✅ Topic restriction enabled with {len(topic_guard.validators)} validators")
-                else:
-                    logger.warning("⚠️ Topic guard created but has no validators")
-            except Exception as e:
-                logger.warning(f"❌ Failed to add topic restriction: {e}")
-        else:
-            logger.info("ℹ️ Topic restriction disabled in configuration")
+        # Guard condivisi tra istanze con la stessa configurazione
+        self.input_guard, self.output_guard = _build_guards(self.config)
+        self._background_tasks: set = set()  # validazioni streaming in corso
         
         self.endpoints = PROTECTED_ENDPOINTS
+        # Endpoint protetti precompilati: path -> config endpoint (None se non protetto)
+        self._endpoint_config = compile_endpoint_matcher(self.endpoints)
         logger.info("✅ GuardrailsMiddleware initialized")
 
-    async def dispatch(self, request: Request, call_next: Callable[[Request], Awaitable[Response]]) -> Response:
-        """Main dispatch with improved error handling"""
-        
-        logger.info(f"🔍 Middleware dispatch called for: {request.method} {request.url.path}")
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Main ASGI entry point with improved error handling"""
         
-        # Skip non-protected endpoints
-        if not self._is_protected_endpoint(request.url.path):
-            logger.info(f"⚡ Endpoint {request.url.path} not protected, skipping validation")
-            return await call_next(request)
+        # Skip non-HTTP traffic and non-protected endpoints
+        endpoint_config = self._endpoint_config(scope["path"]) if scope["type"] == "http" else None
+        if endpoint_config is None:
+            await self.app(scope, receive, send)
+            return
         
-        logger.info(f"🛡️ Endpoint {request.url.path} is protected, applying validation")
-
-        try:
-            # Input validation
-            if should_validate_input(request.url.path, self.endpoints):
-                modified_request, violation = await self._validate_and_modify_input(request)
-                if violation:
-                    return violation
-                request = modified_request or request
+        logger.debug("🛡️ Endpoint %s is protected, applying validation", scope["path"])
 
-            # Process request
-            response = await call_next(request)
+        # Input validation
+        if endpoint_config.get("input", False):
+            receive, violation = await self._validate_and_modify_input(Request(scope, receive))
+            if violation is not None:
+                await violation(scope, receive, send)
+                return
 
-            # Output validation for successful responses
-            if response.status_code == 200:
-                validated_response = await self._validate_output(response)
-                return validated_response or response
-
-            return response
-
-        except Exception as e:
-            logger.error(f"Middleware error for {request.url.path}: {e}")
-            return await call_next(request)  # Graceful fallback
+        # Process request, validating successful responses on the way out
+        await self.app(scope, receive, self._wrap_send(send))
 
     def _is_protected_endpoint(self, path: str) -> bool:
-        """Check if endpoint is protected (improved path matching)"""
-        # Lista diretta degli endpoint protetti per evitare problemi di import
-        protected_endpoints = [
-            "/query",
-            "/chat",  # AGGIUNTO: Protegge streaming endpoint
-            "/conversation",
-            "/conversation/{thread_id}/history"
-        ]
-        
-        for endpoint in protected_endpoints:
-            if path == endpoint:
-                return True
-            # Handle parameterized paths like /conversation/{thread_id}/history
-            if '{' in endpoint:
-                endpoint_pattern = endpoint.replace('{thread_id}', '[^/]+')
-                import re
-                if re.match(f'^{endpoint_pattern}$', path):
-                    return True
-        return False
+        """Check if endpoint is protected (precompiled path matching)"""
+        return self._endpoint_config(path) is not None
 
-    async def _validate_and_modify_input(self, request: Request) -> tuple[Optional[Request], Optional[JSONResponse]]:
-        """Validate input and return modified request if needed"""
+    async def _validate_and_modify_input(self, request: Request) -> Tuple[Receive, Optional[Response]]:
+        """Validate input; returns the receive to pass downstream and an optional violation response"""
         
         if request.method != "POST":
-            return None, None
+            return request.receive, None
+
+        # Fast path senza leggere il body: vuoto, o body che FastAPI non parsa come JSON.
+        # Senza content-type FastAPI fa comunque il parse JSON, quindi va validato
+        content_type = request.headers.get("content-type")
+        if request.headers.get("content-length") == "0" or (content_type and not _is_json_media_type(content_type)):
+            return request.receive, None
 
+        # Read body only once: downstream receives it replayed
+        receive = request.receive
         try:
-            # Read body only once to avoid consumption issues
             body_bytes = await request.body()
+            receive = _replay_receive(body_bytes, request.receive)
             if not body_bytes:
-                return None, None
+                return receive, None
 
             # Parse JSON
             try:
-                data = json.loads(body_bytes.decode('utf-8'))
-            except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                data = orjson.loads(body_bytes)  # valida anche la codifica UTF-8
+            except orjson.JSONDecodeError as e:
                 error_msg = f"Invalid JSON or encoding: {e}"
-                return None, JSONResponse(
+                return receive, Response(
                     status_code=400,
-                    content=create_response_body(error_msg, "format_error")
+                    content=orjson.dumps(create_response_body(error_msg, "format_error")),
+                    media_type="application/json"
                 )
 
             # Extract and validate query
             query = extract_query_from_request(data)
-            if not query:
-                return None, None
+            if self._is_trivial_query(query):
+                return receive, None
 
             # Apply guards validation
             try:
-                logger.info(f"🔄 About to validate with input_guard containing {len(self.input_guard.validators)} validators")
-                for i, validator in enumerate(self.input_guard.validators):
-                    logger.info(f"🔍 Validator {i}: {validator.id} - on_fail is: {validator.on_fail}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("🔄 About to validate with input_guard containing %d validators", len(self.input_guard.validators))
+                    for i, validator in enumerate(self.input_guard.validators):
+                        logger.debug("🔍 Validator %d: %s - on_fail is: %s", i, validator.id, validator.on_fail)
                 
-                logger.info(f"🎯 Validating query: '{query[:50]}...'")
+                logger.debug("🎯 Validating query: '%.50s...'", query)
                 
                 # Run async validation
                 outcome = await self.input_guard.validate(query)
-                logger.info(f"✅ Validation completed successfully")
+                validated_output = outcome.validated_output
+                logger.debug("✅ Validation completed successfully")
+                
+                # A "filter" validator (ProfanityFree) removed the whole query:
+                # nothing valid is left to hand to the endpoint
+                if validated_output is None:
+                    logger.warning("Input validation filtered the whole query")
+                    return receive, Response(
+                        status_code=400,
+                        content=serialize_violation(get_violation_message("profanity", self.config)),
+                        media_type="application/json"
+                    )
                 
                 # Check if content was modified (sanitized)
-                if outcome.validated_output != query:
-                    logger.info(f"Input sanitized: '{query[:50]}...' -> '{outcome.validated_output[:50]}...'")
-                    
-                    # Create new request with modified body
-                    data["query"] = outcome.validated_output
-                    new_body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+                if validated_output != query:
+                    logger.debug("Input sanitized: '%.50s...' -> '%.50s...'", query, validated_output)
                     
-                    # Create new receive callable for modified body
-                    async def new_receive():
-                        return {"type": "http.request", "body": new_body, "more_body": False}
-                    
-                    # Create new request with modified body
-                    new_request = Request(request.scope, receive=new_receive)
-                    return new_request, None
+                    # Passa il body sanificato all'handler via request.state
+                    # (condiviso tramite lo scope ASGI) invece di riserializzarlo
+                    data["query"] = validated_output
+                    request.state.validated_body = data
 
-                return None, None  # No modification needed
+                return receive, None
 
             except Exception as e:
                 # Validation failed - create violation response
-                logger.error(f"🚫 VALIDATION FAILED - Exception type: {type(e).__name__}")
-                logger.error(f"🚫 VALIDATION FAILED - Exception message: {str(e)}")
-                logger.error(f"🚫 VALIDATION FAILED - Full exception: {repr(e)}")
+                logger.error("🚫 VALIDATION FAILED - Exception type: %s", type(e).__name__)
+                logger.error("🚫 VALIDATION FAILED - Exception message: %s", e)
+                logger.error("🚫 VALIDATION FAILED - Full exception: %r", e)
                 
-                # Try to determine which validator failed
-                error_message = str(e)
-                if "dati personali sensibili" in error_message:
-                    logger.error("🚫 FAILED VALIDATOR: ItalianPIIValidator")
-                    violation_type = "pii_violation"
-                elif "sistema AI per analytics" in error_message:
-                    logger.error("🚫 FAILED VALIDATOR: LLMTopicValidator")
-                    violation_type = "topic_violation"
-                elif "toxic" in error_message.lower():
-                    logger.error("🚫 FAILED VALIDATOR: ToxicLanguage")
-                    violation_type = "toxic_violation"
-                else:
-                    logger.error("🚫 FAILED VALIDATOR: Unknown")
-                    violation_type = "content_violation"
+                # Try to determine which validator failed (one regex pass),
+                # on the same span the violation message is chosen from
+                error_message = error_span(str(e))
+                found = {m.lastgroup for m in _VIOLATION_RE.finditer(error_message)}
+                violation_type = next((t for t in _VIOLATION_VALIDATORS if t in found), "content_violation")
+                logger.error("🚫 FAILED VALIDATOR: %s", _VIOLATION_VALIDATORS.get(violation_type, "Unknown"))
                 
-                message = get_violation_message(str(e), self.config)
-                logger.warning(f"Input validation failed: {e}")
+                message = get_violation_message(error_message, self.config)
+                logger.warning("Input validation failed: %s", e)
                 
-                return None, JSONResponse(
+                return receive, Response(
                     status_code=400,
-                    content=create_response_body(message, violation_type)
+                    content=serialize_violation(message, violation_type),
+                    media_type="application/json"
                 )
 
         except Exception as e:
-            logger.error(f"Input validation error: {e}")
-            return None, None  # Graceful fallback
+            logger.error("Input validation error: %s", e)
+            return receive, None  # Graceful fallback
+
+    @staticmethod
+    def _is_trivial_query(query: Optional[str]) -> bool:
+        """Query vuote, troppo corte o saluti: nulla da validare"""
+        if not query:
+            return True
+        stripped = query.strip()
+        return len(stripped) < _MIN_QUERY_CHARS or _TRIVIAL_QUERY_RE.fullmatch(stripped) is not None
 
     # ================================
-    # VERSIONED OUTPUT VALIDATION METHODS
+    # OUTPUT VALIDATION (send wrapper)
     # ================================
 
-    async def _validate_output_original(self, response: Response) -> Optional[Response]:
-        """VERSIONE ORIGINALE - Validate and potentially modify output response"""
+    def _wrap_send(self, send: Send) -> Send:
+        """
+        Wrap send to validate successful responses: JSON bodies are buffered
+        and possibly rewritten, SSE streams pass through and are sniffed
+        """
+        start_message: Optional[Message] = None
+        mode: Optional[str] = None  # "json" | "sse" | None (pass-through)
+        body = bytearray()
+        collector: Optional[_SSETextCollector] = None
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal start_message, mode, collector
+
+            if message["type"] == "http.response.start":
+                if message["status"] == 200:
+                    content_type = ""
+                    for key, value in message.get("headers", ()):
+                        if key.lower() == b"content-type":
+                            content_type = value.decode("latin-1")
+                            break
+                    if "application/json" in content_type:
+                        mode = "json"
+                    # Solo log a posteriori (lo stream non si può bloccare): disattivata di default
+                    elif "text/event-stream" in content_type and self.config.get("validate_streaming_output", False):
+                        logger.debug("🔄 Detected streaming response - applying streaming validation")
+                        mode = "sse"
+                        collector = _SSETextCollector()
+                if mode == "json":
+                    start_message = message  # held until the body is complete
+                    return
+                await send(message)
+                return
+
+            if message["type"] == "http.response.body" and mode == "json":
+                body.extend(message.get("body", b""))
+                more_body = message.get("more_body", False)
+                if len(body) > MAX_VALIDATE_BYTES:
+                    # Troppo grande: niente validazione, inoltra quanto accumulato
+                    logger.debug("Response over %d bytes, skipping output validation", MAX_VALIDATE_BYTES)
+                    mode = None
+                    await send(start_message)
+                    await send({"type": "http.response.body", "body": bytes(body), "more_body": more_body})
+                    body.clear()
+                    return
+                if more_body:
+                    return
+                out_body = await self._validate_output_body(bytes(body))
+                if out_body is not None:
+                    headers = [(k, v) for k, v in start_message["headers"] if k.lower() != b"content-length"]
+                    headers.append((b"content-length", str(len(out_body)).encode("latin-1")))
+                    start_message = {**start_message, "headers": headers}
+                else:
+                    out_body = bytes(body)
+                await send(start_message)
+                await send({"type": "http.response.body", "body": out_body, "more_body": False})
+                return
+
+            if message["type"] == "http.response.body" and mode == "sse":
+                try:
+                    collector.feed(message.get("body", b""))
+                    if not message.get("more_body", False):
+                        self._schedule_streaming_validation(collector)
+                except Exception as e:
+                    logger.error("❌ Error in streaming validation: %s", e)
+
+            # Forward al client (passa sempre)
+            await send(message)
+
+        return send_wrapper
+
+    async def _validate_output_body(self, body_bytes: bytes) -> Optional[bytes]:
+        """Validate a JSON response body; returns the rewritten body if it was sanitized"""
         
         try:
-            # Handle different response types
-            body_bytes = await self._extract_response_body(response)
             if not body_bytes:
                 return None
 
-            # Parse JSON response
+            # Parse JSON response (orjson accepts bytes, no intermediate str)
             try:
-                data = json.loads(body_bytes.decode('utf-8'))
-            except (json.JSONDecodeError, UnicodeDecodeError):
+                data = orjson.loads(body_bytes)
+            except orjson.JSONDecodeError:
                 # Non-JSON response, skip validation
                 return None
 
@@ -227,170 +408,63 @@ class GuardrailsMiddleware(BaseHTTPMiddleware):
 
             # Apply output validation
             try:
-                outcome = self.output_guard.validate(content)
+                validated_output = await self._run_output_guard(content)
                 
                 # Check if content was modified
-                if outcome.validated_output != content:
-                    logger.info(f"Output sanitized: '{content[:50]}...' -> '{outcome.validated_output[:50]}...'")
+                if validated_output != content:
+                    logger.debug("Output sanitized: '%.50s...' -> '%.50s...'", content, validated_output)
                     
                     # Update response data
-                    data["result"] = outcome.validated_output
-                    new_body = json.dumps(data, ensure_ascii=False).encode('utf-8')
-                    
-                    # Create new response with sanitized content
-                    return Response(
-                        content=new_body,
-                        status_code=response.status_code,
-                        headers=dict(response.headers),
-                        media_type=response.media_type or "application/json"
-                    )
+                    data["result"] = validated_output
+                    return orjson.dumps(data)
 
                 return None  # No modification needed
 
             except Exception as e:
                 # Output validation failed - log but don't block
-                logger.warning(f"Output validation failed: {e}")
+                logger.warning("Output validation failed: %s", e)
                 return None  # Continue with original response
 
         except Exception as e:
-            logger.error(f"Output validation error: {e}")
+            logger.error("Output validation error: %s", e)
             return None  # Graceful fallback
 
-    async def _validate_output_new(self, response: Response) -> Optional[Response]:
-        """NUOVA VERSIONE CON STREAMING SUPPORT - Validate output with StreamingResponse handling"""
-        
-        # **NUOVO**: Se è StreamingResponse, usa validation diversa
-        if isinstance(response, StreamingResponse):
-            logger.info("🔄 Detected StreamingResponse - applying streaming validation")
-            return await self._validate_streaming_output(response)
-        
-        # Per response normali, usa logica originale
-        return await self._validate_output_original(response)
-
-    # SWITCH: Cambia qui per abilitare/disabilitare streaming validation
-    _validate_output = _validate_output_new  # ATTIVA: Nuova versione con streaming
-    # _validate_output = _validate_output_original  # ROLLBACK: Versione originale
-
-    async def _extract_response_body(self, response: Response) -> Optional[bytes]:
-        """Extract body from different response types"""
-        
-        try:
-            if isinstance(response, StreamingResponse):
-                # Handle streaming responses
-                chunks = []
-                async for chunk in response.body_iterator:
-                    chunks.append(chunk)
-                return b"".join(chunks)
-            
-            elif hasattr(response, 'body'):
-                # Regular response with body attribute
-                return response.body
-            
-            else:
-                # Response without direct body access
-                return None
-
-        except Exception as e:
-            logger.error(f"Failed to extract response body: {e}")
-            return None
+    async def _run_output_guard(self, text: str) -> Optional[str]:
+        """
+        Validated output for text. AsyncGuard runs the (independent) output
+        validators concurrently and applies their on_fail actions; raises
+        ValidationError on an "exception" failure, None means filtered
+        """
+        outcome = await self.output_guard.validate(text)
+        return outcome.validated_output
 
     # ================================
-    # NUOVI METODI STREAMING VALIDATION
+    # STREAMING VALIDATION
     # ================================
 
-    async def _validate_streaming_output(self, response: StreamingResponse) -> Optional[StreamingResponse]:
+    def _schedule_streaming_validation(self, collector: _SSETextCollector) -> None:
         """
-        NUOVO: Valida output di StreamingResponse accumulando contenuto
+        VALIDATION FINALE sulla coda del testo estratto, in background:
+        la chiusura dello stream non attende la validazione
         """
+        logger.debug("🔍 Validating accumulated streaming content: %d bytes", collector.stream_bytes)
+        final_text_content = collector.finish()
+        
+        if final_text_content and len(final_text_content) > 20:
+            task = asyncio.create_task(self._log_streaming_violations(final_text_content))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+
+    async def _log_streaming_violations(self, text: str) -> None:
+        """Valida il testo di uno stream già inviato e logga eventuali violazioni"""
         try:
-            logger.info("🔄 Starting streaming response validation...")
+            validated_output = await self._run_output_guard(text)
+            logger.debug("✅ Streaming output validation completed successfully")
             
-            # Wrapper del generator originale per accumulare contenuto
-            async def validated_stream_wrapper():
-                accumulated_content = ""
+            # Se il contenuto era problematico, logga warning (ma non bloccare stream già inviato)
+            if validated_output != text:
+                logger.warning("⚠️ Streaming output had content violations - logged for review")
                 
-                try:
-                    # Itera sui chunks del stream originale
-                    async for chunk in response.body_iterator:
-                        # Decode chunk
-                        if isinstance(chunk, bytes):
-                            chunk_str = chunk.decode('utf-8')
-                        else:
-                            chunk_str = str(chunk)
-                        
-                        # Accumula per validation finale
-                        accumulated_content += chunk_str
-                        
-                        # Forward chunk al client (passa sempre)
-                        yield chunk
-                    
-                    # **VALIDATION FINALE** su contenuto accumulato
-                    logger.info(f"🔍 Validating accumulated streaming content: {len(accumulated_content)} chars")
-                    
-                    # Estrai solo il contenuto testuale dai SSE events
-                    final_text_content = self._extract_content_from_sse_stream(accumulated_content)
-                    
-                    if final_text_content and len(final_text_content) > 20:
-                        try:
-                            # Valida contenuto finale con output_guard
-                            outcome = await self.output_guard.validate(final_text_content)
-                            logger.info("✅ Streaming output validation completed successfully")
-                            
-                            # Se il contenuto era problematico, logga warning (ma non bloccare stream già inviato)
-                            if outcome.validated_output != final_text_content:
-                                logger.warning(f"⚠️ Streaming output had content violations - logged for review")
-                                
-                        except Exception as validation_error:
-                            logger.warning(f"⚠️ Streaming output validation failed: {validation_error}")
-                            # Non blocchiamo - stream già inviato
-                    
-                except Exception as e:
-                    logger.error(f"❌ Error in streaming validation wrapper: {e}")
-                    # Yield error event se possibile
-                    error_event = f'data: {{"type": "error", "error": "Validation error during streaming"}}\n\n'
-                    yield error_event.encode('utf-8')
-            
-            # Crea nuovo StreamingResponse con wrapper
-            return StreamingResponse(
-                validated_stream_wrapper(),
-                media_type=response.media_type,
-                headers=dict(response.headers),
-                status_code=response.status_code
-            )
-            
-        except Exception as e:
-            logger.error(f"Streaming validation error: {e}")
-            return None  # Graceful fallback
-
-    def _extract_content_from_sse_stream(self, sse_content: str) -> str:
-        """
-        NUOVO: Estrae contenuto testuale da stream SSE per validation
-        """
-        import json
-        
-        extracted_text = ""
-        
-        try:
-            # Parse linee SSE
-            for line in sse_content.split('\n'):
-                if line.startswith('data: '):
-                    try:
-                        event_data = json.loads(line[6:])  # Rimuovi "data: "
-                        
-                        # Accumula contenuto finale o chunks
-                        if event_data.get("type") == "complete":
-                            final_content = event_data.get("final_content", "")
-                            if final_content:
-                                extracted_text += final_content
-                                break  # Usa solo contenuto finale se disponibile
-                        elif event_data.get("type") == "content":
-                            chunk = event_data.get("chunk", "")
-                            extracted_text += chunk
-                            
-                    except json.JSONDecodeError:
-                        continue  # Skip linee malformate
-                        
-        except Exception as e:
-            logger.warning(f"Failed to extract content from SSE stream: {e}")
-        
-        return extracted_text
+        except Exception as validation_error:
+            logger.warning("⚠️ Streaming output validation failed: %s", validation_error)
+            # Non blocchiamo - stream già inviato
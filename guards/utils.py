@@ -1,4 +1,5 @@
-from typing import Optional, Dict, Any, cast, Callable
+import re
+from typing import Optional, Dict, Any, Hashable, Tuple, cast, Callable
 from guardrails import OnFailAction
 
 def extract_query_from_request(data: dict) -> Optional[str]:
@@ -10,25 +11,49 @@ def extract_content_from_response(response_data: dict) -> Optional[str]:
     if "result" in response_data:
         return response_data["result"]
     
-    # Conversation history
+    # Conversation history: last AI message, precomputed by the endpoint when available
+    if "last_ai_content" in response_data:
+        return response_data["last_ai_content"]
     if "conversation_history" in response_data:
         messages = response_data["conversation_history"]
-        if isinstance(messages, list) and messages:
-            for msg in reversed(messages):
-                if msg.get("type") == "ai":
-                    return msg.get("content")
+        if isinstance(messages, list):
+            return next((m.get("content") for m in reversed(messages) if m.get("type") == "ai"), None)
     return None
 
-def is_protected_endpoint(path: str, endpoints: Dict[str, Any]) -> bool:
-    """Check if endpoint needs protection"""
-    return path in endpoints or any(path.startswith(ep.split('{')[0]) for ep in endpoints.keys())
+def freeze_config(value: Any) -> Hashable:
+    """Recursively turn a config (nested dicts/lists) into a hashable cache key"""
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze_config(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze_config(v) for v in value)
+    if isinstance(value, set):
+        return frozenset(freeze_config(v) for v in value)
+    return value
 
-def should_validate_input(path: str, endpoints: Dict[str, Any]) -> bool:
-    """Check if endpoint needs input validation"""
-    for endpoint, config in endpoints.items():
-        if path == endpoint or path.startswith(endpoint.split('{')[0]):
-            return config.get("input", False)
-    return False
+def _endpoint_regex(endpoint: str) -> str:
+    """Regex for an endpoint template: each {param} matches one path segment"""
+    return "[^/]+".join(re.escape(part) for part in re.split(r"\{\w+\}", endpoint))
+
+def compile_endpoint_matcher(endpoints: Dict[str, Any]) -> Callable[[str], Optional[Dict[str, Any]]]:
+    """
+    Precompile protected endpoints into a path -> endpoint config lookup:
+    exact paths via dict, ``{param}`` templates via one anchored regex alternation
+    """
+    exact = {ep: cfg for ep, cfg in endpoints.items() if '{' not in ep}
+    templated = [(ep, cfg) for ep, cfg in endpoints.items() if '{' in ep]
+    pattern = re.compile("|".join(
+        f"(?P<g{i}>{_endpoint_regex(ep)})" for i, (ep, _) in enumerate(templated)
+    )) if templated else None
+
+    def match(path: str) -> Optional[Dict[str, Any]]:
+        cfg = exact.get(path)
+        if cfg is None and pattern is not None:
+            m = pattern.fullmatch(path)
+            if m is not None:
+                cfg = templated[int(m.lastgroup[1:])][1]
+        return cfg
+
+    return match
 
 
 on_fail_exc = cast(Callable[..., Any], OnFailAction.EXCEPTION)
@@ -1,4 +1,5 @@
 import logging
+from typing import Optional
 from guardrails import Guard
 from guardrails.hub import ToxicLanguage, ProfanityFree, DetectPII
 from guards.utils import on_fail_exc, on_fail_filter
@@ -8,7 +9,7 @@ logger = logging.getLogger(__name__)
 from guards.utils import OnFailAction
 from guardrails import AsyncGuard
 
-def create_input_guard(config: dict) -> AsyncGuard:
+def create_input_guard(config: dict, extra_validators: Optional[list] = None) -> AsyncGuard:
     """Create async input validation guard with PII detection and topic restriction"""
     try:
         validators = []
@@ -30,16 +31,18 @@ def create_input_guard(config: dict) -> AsyncGuard:
             except Exception as e:
                 logger.warning(f"PII validator failed: {e}")
         
-        # Add topic restriction if enabled
+        # Add topic restriction if enabled (validator shared with add_topic_restriction)
         if config.get("enable_topic_restriction", False) and config.get("use_llm_topic", False):
             try:
-                from .custom import LLMTopicValidator
-                topic_validator = LLMTopicValidator(on_fail="exception")
-                validators.append(topic_validator)
+                from .custom import create_topic_validator
+                validators.append(create_topic_validator(config))
                 logger.info("✅ LLM Topic restriction enabled")
             except Exception as e:
                 logger.warning(f"Topic validator failed: {e}")
         
+        if extra_validators:
+            validators.extend(extra_validators)
+        
         # Add toxic language detection
         validators.append(
             ToxicLanguage(threshold=config.get("toxic_threshold", 0.8), on_fail="exception")
@@ -56,13 +59,13 @@ def create_input_guard(config: dict) -> AsyncGuard:
         logger.warning(f"Async input guard creation failed: {e}")
         return AsyncGuard().use(ProfanityFree(on_fail="filter"))
 
-def create_output_guard(config: dict) -> Guard:
-    """Create output validation guard"""
+def create_output_guard(config: dict) -> AsyncGuard:
+    """Create async output validation guard (validators run concurrently)"""
     try:
-        return Guard().use_many(
+        return AsyncGuard().use_many(
             ToxicLanguage(threshold=config.get("toxic_threshold", 0.9), on_fail=on_fail_exc),
             ProfanityFree(on_fail=on_fail_filter)
         )
     except Exception as e:
         logger.warning(f"Output guard creation failed: {e}")
-        return Guard()
\ No newline at end of file
+        return AsyncGuard()
\ No newline at end of file
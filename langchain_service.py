@@ -11,12 +11,20 @@ from langchain.memory import ConversationBufferMemory
 from langchain.chains import ConversationChain
 from langchain.schema import BaseMessage
 from langchain.prompts import PromptTemplate
-from typing import Dict, List, Any, Optional
-import json
-import pandas as pd
+from langchain_core.chat_history import BaseChatMessageHistory, InMemoryChatMessageHistory
+from typing import Container, Dict, List, Any, Optional, Union
+from collections import OrderedDict
+import re
+import logging
+import orjson
 from pathlib import Path
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
+# Righe di apertura/chiusura dei code block (```json, ```) incluso il newline
+_FENCE_LINE_RE = re.compile(r'^[^\S\n]*```[^\n]*(?:\n|\Z)', re.MULTILINE)
+
 
 class ConversationalLangChainService:
     """
@@ -24,13 +32,25 @@ class ConversationalLangChainService:
     Template intelligente che decide se generare JSON MongoDB o risposta generale.
     """
 
-    def __init__(self, model_name: str, base_url: str):
+    def __init__(
+            self,
+            model_name: str,
+            base_url: str,
+            max_conversations: int = 1000,
+            client_kwargs: Optional[dict] = None,
+            keep_alive: Optional[Union[int, str]] = None,
+            num_ctx: Optional[int] = None
+    ):
         """
         Inizializza servizio con LLM Ollama e memoria conversazionale.
 
         Args:
             model_name: Nome modello Ollama
             base_url: URL base Ollama
+            max_conversations: Numero massimo di conversazioni tenute in memoria (LRU)
+            client_kwargs: Opzioni del client HTTP Ollama (es. limiti del pool keep-alive)
+            keep_alive: Per quanto Ollama tiene il modello caricato dopo una richiesta (es. "24h")
+            num_ctx: Contesto del modello in token (None = default Ollama)
         """
         self.model_name = model_name
         self.base_url = base_url
@@ -40,11 +60,25 @@ class ConversationalLangChainService:
             model=model_name,
             base_url=base_url,
             temperature=0.1,
-            timeout=60
+            timeout=60,
+            keep_alive=keep_alive,
+            num_ctx=num_ctx,
+            client_kwargs=client_kwargs or {}
         )
 
-        # Storage ConversationChain per thread
-        self._conversation_chains: Dict[str, ConversationChain] = {}
+        # Storage ConversationChain per thread, in ordine LRU (memoria limitata)
+        self._conversation_chains: "OrderedDict[str, ConversationChain]" = OrderedDict()
+        self._max_chains = max_conversations
+
+        # Storia messaggi per thread, condivisa con StreamingService: ogni
+        # servizio ha il proprio wrapper di memoria sulla stessa storia
+        self.memory_store: Dict[str, BaseChatMessageHistory] = {}
+        # Thread ancora usati da un altro servizio sulla stessa storia
+        # (share_threads_in_use): all'evizione la loro storia resta
+        self._store_threads_in_use: Container[str] = ()
+
+        # Prompt con schema già applicato, per campi dello schema (condiviso tra thread)
+        self._prompt_cache: Dict[Optional[tuple], PromptTemplate] = {}
 
         # Template prompt intelligente
         self.prompt_template = self._create_intelligent_prompt_template()
@@ -53,7 +87,7 @@ class ConversationalLangChainService:
         self.temp_dir = Path("temp_results")
         self.temp_dir.mkdir(exist_ok=True)
 
-        print(f"ConversationalLangChainService inizializzato - Modello: {model_name}")
+        logger.info("ConversationalLangChainService inizializzato - Modello: %s", model_name)
 
     def _create_intelligent_prompt_template(self) -> PromptTemplate:
         """
@@ -104,6 +138,22 @@ Assistente:"""
             template=template
         )
 
+    def _get_schema_prompt(self, schema: Optional[dict]) -> PromptTemplate:
+        """
+        Prompt template con lo schema applicato, riusato tra thread con gli stessi campi.
+        """
+        key = tuple(schema.keys()) if schema else None
+        prompt = self._prompt_cache.get(key)
+        if prompt is None:
+            # Schema text - format as simple list to avoid template variable conflicts
+            if schema:
+                schema_fields = [f"- {field}" for field in schema.keys()]
+                schema_text = "Campi disponibili:\n" + "\n".join(schema_fields) if schema_fields else "Schema vuoto"
+            else:
+                schema_text = "Schema non disponibile"
+            prompt = self._prompt_cache[key] = self.prompt_template.partial(schema=schema_text)
+        return prompt
+
     def _get_conversation_chain(self, thread_id: str, schema: dict = None) -> ConversationChain:
         """
         Recupera o crea ConversationChain con BufferMemory per thread.
@@ -111,30 +161,35 @@ Assistente:"""
         if thread_id not in self._conversation_chains:
             # Crea memoria buffer
             memory = ConversationBufferMemory(
+                chat_memory=self.memory_store.setdefault(thread_id, InMemoryChatMessageHistory()),
                 memory_key="history",
                 return_messages=False,
                 human_prefix="Utente",
                 ai_prefix="Assistente"
             )
 
-            # Schema text - format as simple list to avoid template variable conflicts
-            if schema:
-                schema_fields = [f"- {field}" for field in schema.keys()]
-                schema_text = "Campi disponibili:\n" + "\n".join(schema_fields) if schema_fields else "Schema vuoto"
-            else:
-                schema_text = "Schema non disponibile"
-
             # Crea ConversationChain con partial variables per schema
             conversation = ConversationChain(
                 llm=self.llm,
                 memory=memory,
-                prompt=self.prompt_template.partial(schema=schema_text),
+                prompt=self._get_schema_prompt(schema),
                 verbose=False
             )
 
             self._conversation_chains[thread_id] = conversation
-            print(f"Nuova conversazione per thread: {thread_id}")
-
+            logger.debug("Nuova conversazione per thread: %s", thread_id)
+
+            # Evict conversazione usata meno di recente oltre il limite
+            if len(self._conversation_chains) > self._max_chains:
+                old_id, old_chain = self._conversation_chains.popitem(last=False)
+                # La storia resta se lo streaming usa ancora il thread
+                if old_id not in self._store_threads_in_use:
+                    old_chain.memory.clear()
+                    self.memory_store.pop(old_id, None)
+                logger.debug("Conversazione rimossa (LRU): %s", old_id)
+            return conversation
+
+        self._conversation_chains.move_to_end(thread_id)
         return self._conversation_chains[thread_id]
 
     async def generate_mongodb_query(
@@ -153,19 +208,19 @@ Assistente:"""
             # Recupera conversazione
             conversation = self._get_conversation_chain(thread_id, collection_schema)
 
-            print(f"Elaborazione per thread {thread_id}: {user_input}")
+            logger.debug("Elaborazione per thread %s: %s", thread_id, user_input)
 
             # Genera risposta
             llm_response = await conversation.apredict(input=user_input)
 
-            print(f"LLM response: {llm_response[:150]}...")
+            logger.debug("LLM response: %.150s...", llm_response)
 
             # Processa risposta
             result = self._process_intelligent_response(llm_response, user_input)
             return result
 
         except Exception as e:
-            print(f"Errore elaborazione: {e}")
+            logger.error("Errore elaborazione: %s", e)
             return {}
 
     def _process_intelligent_response(self, llm_response: str, user_input: str) -> dict:
@@ -177,11 +232,11 @@ Assistente:"""
             mongodb_query = self._parse_mongodb_json(llm_response)
 
             if mongodb_query:
-                print(f"Rilevata query MongoDB: {mongodb_query}")
+                logger.debug("Rilevata query MongoDB: %s", mongodb_query)
                 return mongodb_query
 
             # Risposta conversazionale
-            print("Rilevata risposta conversazionale")
+            logger.debug("Rilevata risposta conversazionale")
             return {
                 "_type": "general_response",
                 "_content": llm_response.strip(),
@@ -189,7 +244,7 @@ Assistente:"""
             }
 
         except Exception as e:
-            print(f"Errore processing response: {e}")
+            logger.error("Errore processing response: %s", e)
             return {}
 
     def _parse_mongodb_json(self, llm_response: str) -> dict:
@@ -197,77 +252,70 @@ Assistente:"""
         Parse risposta LLM in query MongoDB valida.
         """
         try:
-            cleaned = llm_response.strip()
-
-            # Rimuovi code blocks
-            if "```" in cleaned:
-                lines = cleaned.split('\n')
-                json_lines = []
-                in_code_block = False
-
-                for line in lines:
-                    if line.strip().startswith('```'):
-                        in_code_block = not in_code_block
-                        continue
-                    if not line.strip().startswith('```'):
-                        json_lines.append(line)
-
-                cleaned = '\n'.join(json_lines).strip()
+            # Rimuovi code blocks (righe che iniziano con ```) in un solo passaggio
+            cleaned = _FENCE_LINE_RE.sub('', llm_response).strip()
 
             # Parse JSON solo se sembra JSON
             if cleaned.startswith('{') and cleaned.endswith('}'):
-                parsed = json.loads(cleaned)
+                parsed = orjson.loads(cleaned)
                 if isinstance(parsed, dict):
                     return parsed
 
             return {}
 
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             return {}
         except Exception as e:
-            print(f"Parse error: {e}")
+            logger.warning("Parse error: %s", e)
             return {}
 
+    def share_threads_in_use(self, threads_in_use: Container[str]) -> None:
+        """
+        Thread attivi in un altro servizio che usa memory_store (es. le
+        conversazioni di StreamingService): la loro storia non viene rimossa
+        quando qui la ConversationChain viene rimossa (LRU)
+        """
+        self._store_threads_in_use = threads_in_use
+
     async def get_conversation_history(self, thread_id: str) -> List[BaseMessage]:
         """
         Recupera storia conversazione da ConversationBufferMemory.
         """
-        if thread_id not in self._conversation_chains:
+        # Storia condivisa: include anche i turni avvenuti via streaming
+        history = self.memory_store.get(thread_id)
+        if history is None:
             return []
 
         try:
-            conversation = self._conversation_chains[thread_id]
-            memory = conversation.memory
-            messages = memory.chat_memory.messages
-            return messages
+            return history.messages
 
         except Exception as e:
-            print(f"Errore recupero storia: {e}")
+            logger.error("Errore recupero storia: %s", e)
             return []
 
     async def clear_conversation_memory(self, thread_id: str) -> bool:
         """
-        Pulisce ConversationBufferMemory per thread.
+        Pulisce la storia del thread (condivisa: anche i turni via streaming).
         """
-        if thread_id not in self._conversation_chains:
+        history = self.memory_store.pop(thread_id, None)
+        self._conversation_chains.pop(thread_id, None)
+        if history is None:
             return False
 
         try:
-            conversation = self._conversation_chains[thread_id]
-            conversation.memory.clear()
-            del self._conversation_chains[thread_id]
-            print(f"Memoria pulita per thread: {thread_id}")
+            history.clear()
+            logger.debug("Memoria pulita per thread: %s", thread_id)
             return True
 
         except Exception as e:
-            print(f"Errore pulizia memoria: {e}")
+            logger.error("Errore pulizia memoria: %s", e)
             return False
 
     async def list_active_threads(self) -> List[str]:
         """
-        Lista thread con conversazioni attive.
+        Lista thread con conversazioni attive (storia condivisa con lo streaming).
         """
-        return list(self._conversation_chains.keys())
+        return list(self.memory_store.keys())
 
     async def save_large_results(
             self,
@@ -279,18 +327,22 @@ Assistente:"""
         Salva risultati grandi in file Parquet.
         """
         try:
+            # pandas solo qui (import pesante, usato raramente); il writer è
+            # fastparquet, la dipendenza parquet del progetto (pyarrow non installato)
+            import pandas as pd
+
             df = pd.DataFrame(documents)
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             filename = f"{thread_id}_{timestamp}.parquet"
             file_path = self.temp_dir / filename
 
-            df.to_parquet(file_path, index=False)
-            print(f"Salvati {len(documents)} documenti in {filename}")
+            df.to_parquet(file_path, engine="fastparquet", index=False)
+            logger.info("Salvati %d documenti in %s", len(documents), filename)
             return str(file_path)
 
         except Exception as e:
             error_msg = f"Errore salvataggio: {str(e)}"
-            print(error_msg)
+            logger.error(error_msg)
             raise Exception(error_msg)
 
     async def test_connection(self) -> bool:
@@ -300,10 +352,10 @@ Assistente:"""
         try:
             response = await self.llm.ainvoke("test connection")
             success = len(response.strip()) > 0
-            print(f"Test LLM: {'OK' if success else 'FAILED'}")
+            logger.info("Test LLM: %s", "OK" if success else "FAILED")
             return success
         except Exception as e:
-            print(f"Test LLM fallito: {e}")
+            logger.error("Test LLM fallito: %s", e)
             return False
 
     async def health_check(self) -> bool:
@@ -312,12 +364,12 @@ Assistente:"""
         """
         try:
             llm_ok = await self.test_connection()
-            active_threads = len(self._conversation_chains)
-            print(f"Health check: LLM={'OK' if llm_ok else 'FAILED'}, Threads={active_threads}")
+            active_threads = len(self.memory_store)
+            logger.info("Health check: LLM=%s, Threads=%d", "OK" if llm_ok else "FAILED", active_threads)
             return llm_ok
 
         except Exception as e:
-            print(f"Health check fallito: {e}")
+            logger.error("Health check fallito: %s", e)
             return False
 
     async def cleanup(self) -> None:
@@ -327,11 +379,11 @@ Assistente:"""
         try:
             # Clear conversazioni
             cleared_count = 0
-            for thread_id in list(self._conversation_chains.keys()):
+            for thread_id in list(self.memory_store.keys()):
                 if await self.clear_conversation_memory(thread_id):
                     cleared_count += 1
 
-            print(f"Pulite {cleared_count} conversazioni")
+            logger.info("Pulite %d conversazioni", cleared_count)
 
             # Cleanup file temporanei vecchi
             import time
@@ -344,7 +396,7 @@ Assistente:"""
                     cleaned_files += 1
 
             if cleaned_files > 0:
-                print(f"Rimossi {cleaned_files} file temporanei")
+                logger.info("Rimossi %d file temporanei", cleaned_files)
 
         except Exception as e:
-            print(f"Warning durante cleanup: {e}")
\ No newline at end of file
+            logger.warning("Warning durante cleanup: %s", e)
\ No newline at end of file
@@ -10,18 +10,223 @@ Version: 1.0.0
 """
 
 import logging
-import json
-from typing import AsyncGenerator, Optional, Dict, Any, List
+import orjson
+import asyncio
+import hashlib
+import operator
+import functools
+import string
+import httpx
+import time
+import weakref
+from typing import AsyncGenerator, AsyncIterator, Callable, Container, Optional, Dict, Any, List, Tuple, Union
+from collections import OrderedDict
 from datetime import datetime
 
 # Import delle classi base
 from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationChain
-from langchain_community.chat_models import ChatOllama
+from langchain_ollama import ChatOllama
 from langchain.schema import BaseMessage
+from langchain_core.chat_history import BaseChatMessageHistory, InMemoryChatMessageHistory
+from langchain_core.messages import HumanMessage, SystemMessage
 
 logger = logging.getLogger(__name__)
 
+# Il prefisso del prompt deve stare nel contesto del modello (num_ctx): se lo
+# supera Ollama tronca l'inizio del prompt, cioè system prompt e schema.
+# Budget in caratteri con una stima prudente per token, lasciando spazio
+# a domanda e risposta del turno
+_CHARS_PER_TOKEN = 3
+_RESERVED_CONTEXT_TOKENS = 2048
+
+# Intestazione immutabile del prompt streaming (segue la cronologia)
+_PROMPT_HEADER = string.Template("""
+$system
+
+SCHEMA COLLEZIONE MONGODB:
+$schema
+
+CRONOLOGIA CONVERSAZIONE:
+""")
+
+# Dimensione dei chunk sintetici con cui si ristreamma una risposta in cache
+_CACHED_CHUNK_CHARS = 32
+
+
+async def _coalesce_chunks(
+    chunks: AsyncGenerator[str, None],
+    max_chars: int = 64,
+    max_ms: float = 25.0,
+    min_chars: int = 1,
+    growth: float = 2.0
+) -> AsyncGenerator[str, None]:
+    """
+    Raggruppa i chunk dello stream: emette quando il buffer raggiunge la
+    soglia corrente o sono passati max_ms dal primo chunk in attesa.
+    La soglia parte da min_chars (primo token subito, TTFT invariato) e
+    cresce di growth a ogni emissione fino a max_chars.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = chunks.__aiter__()
+    buffer: List[str] = []
+    buffered = 0
+    target = float(min_chars)
+    deadline: Optional[float] = None
+    # Il __anext__ in attesa non va mai cancellato allo scadere del timeout
+    # (chiuderebbe il generatore): si attende di nuovo lo stesso task
+    pending: Optional[asyncio.Future] = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = None if deadline is None else max(deadline - loop.time(), 0.0)
+            done, _ = await asyncio.wait((pending,), timeout=timeout)
+            if done:
+                try:
+                    chunk = pending.result()
+                except StopAsyncIteration:
+                    pending = None
+                    break
+                pending = None
+                buffer.append(chunk)
+                buffered += len(chunk)
+                if deadline is None:
+                    deadline = loop.time() + max_ms / 1000
+                if buffered < target and loop.time() < deadline:
+                    continue
+            # Soglia raggiunta o timeout: emetti il buffer
+            yield "".join(buffer)
+            buffer.clear()
+            buffered = 0
+            deadline = None
+            target = min(float(max_chars), target * growth)
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        if pending is not None:
+            pending.cancel()
+            try:
+                await pending
+            except BaseException:
+                pass
+        await iterator.aclose()
+
+
+async def _buffer_chunks(chunks: AsyncGenerator[str, None], size: int = 64) -> AsyncGenerator[str, None]:
+    """
+    Disaccoppia produzione e consumo dello stream: un task consuma la
+    generazione in una coda limitata mentre il client legge, così una
+    scrittura di rete lenta non ferma la generazione dei token
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=size)
+    end_of_stream = object()
+    error: Optional[BaseException] = None
+
+    async def produce() -> None:
+        nonlocal error
+        try:
+            async for chunk in chunks:
+                await queue.put(chunk)
+        except Exception as e:
+            error = e
+        finally:
+            await chunks.aclose()
+        await queue.put(end_of_stream)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is end_of_stream:
+                break
+            yield chunk
+        if error is not None:
+            raise error
+    finally:
+        # Client disconnesso o stream chiuso: ferma la generazione
+        producer.cancel()
+        try:
+            await producer
+        except BaseException:
+            pass
+
+
+# Chiavi non stringa ammesse come in json.dumps (convertite in stringa)
+_SCHEMA_JSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+@functools.lru_cache(maxsize=64)
+def _format_schema_cached(schema_json: bytes) -> str:
+    """Righe dello schema per il prompt, memoizzate per JSON dello schema"""
+    return "\n".join(
+        _format_schema_field(field, details)
+        for field, details in orjson.loads(schema_json).items()
+    )
+
+
+def _format_schema_field(field: str, details: Any) -> str:
+    """Riga di un campo: tipo e descrizione se details è un oggetto, altrimenti il valore"""
+    try:
+        field_desc = details.get('description', '')
+        line = f"- {field}: {details.get('type', 'unknown')}"
+    except AttributeError:  # dopo orjson.loads solo i dict hanno .get
+        return f"- {field}: {details}"
+    return f"{line} ({field_desc})" if field_desc else line
+
+
+class _SemanticCache:
+    """
+    Cache semantica delle risposte: embedding normalizzati in una matrice
+    (ring buffer, le voci più vecchie vengono sovrascritte), con lo scope
+    (prompt di sistema + schema) che deve coincidere per un hit
+    """
+
+    def __init__(self, size: int, threshold: float):
+        import numpy as np  # dipendenza di pandas, caricata solo se la cache è attiva
+
+        self._np = np
+        self.size = size
+        self.threshold = threshold
+        self._matrix = None  # (size, dim) allocata al primo embedding
+        self._scopes = np.zeros(size, dtype=np.int64)
+        self._responses: List[Optional[str]] = [None] * size
+        self._count = 0
+
+    def _normalize(self, embedding: List[float]):
+        vector = self._np.asarray(embedding, dtype=self._np.float32)
+        norm = self._np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, scope: int, embedding: List[float]) -> Optional[str]:
+        """Risposta cached più simile nello stesso scope, se sopra soglia"""
+        filled = min(self._count, self.size)
+        if not filled:
+            return None
+        vector = self._normalize(embedding)
+        if vector.shape[0] != self._matrix.shape[1]:
+            return None
+        # Un solo prodotto matrice-vettore su tutte le voci
+        similarities = self._matrix[:filled] @ vector
+        similarities[self._scopes[:filled] != scope] = -1.0
+        best = int(similarities.argmax())
+        if similarities[best] < self.threshold:
+            return None
+        logger.debug("🎯 Semantic cache hit (similarity %.3f)", similarities[best])
+        return self._responses[best]
+
+    def store(self, scope: int, embedding: List[float], response: str) -> None:
+        """Aggiunge una risposta sovrascrivendo la voce più vecchia oltre la capacità"""
+        vector = self._normalize(embedding)
+        if self._matrix is None:
+            self._matrix = self._np.zeros((self.size, vector.shape[0]), dtype=self._np.float32)
+        elif vector.shape[0] != self._matrix.shape[1]:
+            return
+        slot = self._count % self.size
+        self._matrix[slot] = vector
+        self._scopes[slot] = scope
+        self._responses[slot] = response
+        self._count += 1
+
 
 class StreamingService:
     """
@@ -31,28 +236,104 @@ class StreamingService:
     Mantiene compatibilità completa con ConversationBufferMemory.
     """
     
-    def __init__(self, model_name: str = "gemma3:latest", base_url: str = "http://localhost:11434"):
+    # Messaggi schema già costruiti, per hash dello schema (condivisi tra istanze)
+    # in ordine LRU e limitati come _format_schema_cached: i sample cambiano lo schema
+    _SCHEMA_MESSAGES: "OrderedDict[str, SystemMessage]" = OrderedDict()
+    _SCHEMA_MESSAGES_MAX = 64
+    
+    def __init__(
+        self,
+        model_name: str = "gemma3:latest",
+        base_url: str = "http://localhost:11434",
+        semantic_cache_size: int = 0,
+        semantic_cache_threshold: float = 0.95,
+        embedding_model: str = "nomic-embed-text",
+        client_kwargs: Optional[dict] = None,
+        stream_batch_chars: int = 64,
+        stream_batch_ms: float = 25.0,
+        stream_min_batch_chars: int = 1,
+        stream_batch_growth: float = 2.0,
+        max_conversations: int = 10000,
+        conversation_ttl: float = 3600.0,
+        keep_alive: Optional[Union[int, str]] = None,
+        num_ctx: int = 8192
+    ):
         """
         Inizializza il servizio streaming
         
         Args:
             model_name: Nome del modello Ollama
             base_url: URL base per Ollama
+            semantic_cache_size: Risposte tenute in cache semantica (0 = disattivata)
+            semantic_cache_threshold: Similarità coseno minima per riusare una risposta
+            embedding_model: Modello Ollama per gli embedding della cache
+            client_kwargs: Opzioni del client HTTP Ollama (es. limiti del pool keep-alive)
+            stream_batch_chars: Caratteri massimi per chunk emesso (raggruppamento token)
+            stream_batch_ms: Attesa massima prima di emettere i token raggruppati
+            stream_min_batch_chars: Soglia del primo chunk emesso
+            stream_batch_growth: Fattore di crescita della soglia a ogni chunk emesso
+            max_conversations: Numero massimo di conversazioni tenute in memoria (LRU)
+            conversation_ttl: Secondi di inattività dopo cui una conversazione viene rimossa
+            keep_alive: Per quanto Ollama tiene il modello caricato dopo una richiesta (es. "24h")
+            num_ctx: Contesto del modello in token; limita anche la lunghezza del prompt
         """
         self.model_name = model_name
         self.base_url = base_url
+        self.keep_alive = keep_alive
+        self.num_ctx = num_ctx
+        # Oltre questa lunghezza il prefisso di un thread viene ricostruito con i soli
+        # messaggi recenti (metà budget): raro, tra una ricostruzione e l'altra cresce solo in coda
+        self._max_prompt_prefix_chars = max(num_ctx - _RESERVED_CONTEXT_TOKENS, num_ctx // 2) * _CHARS_PER_TOKEN
+        
+        # Raggruppamento dei token in chunk più grandi (meno frame SSE)
+        self._stream_batching = {
+            "max_chars": stream_batch_chars,
+            "max_ms": stream_batch_ms,
+            "min_chars": stream_min_batch_chars,
+            "growth": stream_batch_growth,
+        }
+        
+        # Cache semantica opzionale: solo per il primo turno di un thread, le
+        # risposte successive dipendono dalla cronologia della conversazione
+        self._semantic_cache: Optional[_SemanticCache] = None
+        if semantic_cache_size > 0:
+            from langchain_ollama import OllamaEmbeddings
+            
+            self._embeddings = OllamaEmbeddings(model=embedding_model, base_url=base_url)
+            self._semantic_cache = _SemanticCache(semantic_cache_size, semantic_cache_threshold)
         
-        # Setup LLM con streaming enabled
+        # Setup LLM (astream fa streaming token per token). Il client httpx
+        # di langchain_ollama resta aperto: connessioni keep-alive riusate
+        # tra le richieste invece di una nuova sessione per chiamata
         self.llm = ChatOllama(
             model=model_name,
             base_url=base_url,
             temperature=0.1,
-            streaming=True,  # IMPORTANTE: Abilita streaming
-            verbose=True
+            verbose=True,
+            keep_alive=keep_alive,
+            num_ctx=num_ctx,
+            client_kwargs=client_kwargs or {}
         )
         
-        # Cache per conversazioni (shared con servizio principale se necessario)
-        self.conversations: Dict[str, ConversationBufferMemory] = {}
+        # Client HTTP leggero per le health check (creato al primo uso)
+        self._http: Optional[httpx.AsyncClient] = None
+        
+        # Cache per conversazioni (shared con servizio principale se necessario),
+        # in ordine LRU con scadenza per inattività (memoria limitata)
+        self.conversations: "OrderedDict[str, ConversationBufferMemory]" = OrderedDict()
+        self._conversation_last_used: Dict[str, float] = {}
+        self._max_conversations = max_conversations
+        self._conversation_ttl = conversation_ttl
+        # Storia messaggi per thread; condivisibile con il servizio
+        # conversazionale tramite share_message_store()
+        self.message_store: Dict[str, BaseChatMessageHistory] = {}
+        self._store_threads_in_use: Container[str] = ()
+        # Lock per thread, rimossi automaticamente quando nessun turno li usa
+        self._thread_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        
+        # Prompt per thread, solo appeso tra un turno e l'altro così il prefix
+        # cache KV di Ollama (llama.cpp) viene riusato: thread -> (schema, prefisso, messaggi)
+        self._prompt_prefixes: Dict[str, Tuple[str, str, int]] = {}
         
         # System prompt per MongoDB analytics E conversazione
         self.system_prompt = """Sei un assistente AI chiamato Claude che può aiutare con conversazioni e query MongoDB.
@@ -83,6 +364,12 @@ RICORDA:
 - Rispondi sempre dalla prospettiva di assistente AI
 """
         
+        # Messaggio di sistema costruito una volta (graffe non più escapate:
+        # il testo non passa da un template)
+        self._system_message = SystemMessage(
+            content=self.system_prompt.replace("{{", "{").replace("}}", "}")
+        )
+        
         logger.info(f"✅ StreamingService inizializzato con modello: {model_name}")
     
     async def stream_mongodb_query(
@@ -92,7 +379,8 @@ RICORDA:
         collection_schema: dict
     ) -> AsyncGenerator[str, None]:
         """
-        Versione streaming di generate_mongodb_query usando ConversationChain.astream()
+        Versione streaming di generate_mongodb_query: ChatOllama.astream() su
+        messaggi precostruiti (sistema, schema, cronologia, input)
         
         Args:
             thread_id: ID del thread conversazione
@@ -100,65 +388,10 @@ RICORDA:
             collection_schema: Schema della collezione MongoDB
             
         Yields:
-            str: Chunks di risposta in tempo reale
+            str: Chunks di risposta in tempo reale (token raggruppati, bufferizzati)
         """
-        try:
-            logger.info(f"🔄 Starting streaming for thread {thread_id}")
-            
-            # Setup memoria conversazionale
-            if thread_id not in self.conversations:
-                self.conversations[thread_id] = ConversationBufferMemory(
-                    memory_key="chat_history",
-                    return_messages=True
-                )
-            
-            memory = self.conversations[thread_id]
-            
-            # Crea chain conversazionale
-            conversation_chain = ConversationChain(
-                llm=self.llm,
-                memory=memory,
-                prompt=self._create_intelligent_prompt_template(collection_schema),
-                verbose=True
-            )
-            
-            accumulated_response = ""
-            chunk_count = 0
-            
-            # **STREAMING REALE** tramite ConversationChain.astream()
-            async for chunk in conversation_chain.astream({"input": user_input}):
-                chunk_count += 1
-                
-                # ConversationChain.astream() restituisce dict con chiavi specifiche
-                chunk_content = ""
-                if isinstance(chunk, dict):
-                    # Estrai il contenuto dal chunk
-                    if "response" in chunk:
-                        chunk_content = chunk["response"]
-                    elif "output" in chunk:
-                        chunk_content = chunk["output"]
-                    elif "text" in chunk:
-                        chunk_content = chunk["text"]
-                    else:
-                        # Prova a estrarre dal primo valore non-vuoto
-                        for key, value in chunk.items():
-                            if isinstance(value, str) and value.strip():
-                                chunk_content = value
-                                break
-                else:
-                    chunk_content = str(chunk)
-                
-                if chunk_content:
-                    accumulated_response += chunk_content
-                    logger.debug(f"📦 Chunk {chunk_count}: {len(chunk_content)} chars")
-                    yield chunk_content
-            
-            logger.info(f"✅ Streaming completato per thread {thread_id}: {chunk_count} chunks, {len(accumulated_response)} caratteri")
-            
-        except Exception as e:
-            logger.error(f"❌ Errore durante streaming: {e}")
-            error_msg = f"Errore durante elaborazione streaming: {str(e)}"
-            yield error_msg
+        async for chunk in self._stream(thread_id, user_input, collection_schema, self._messages_source):
+            yield chunk
 
     async def stream_mongodb_query_alternative(
         self, 
@@ -169,7 +402,7 @@ RICORDA:
         """
         METODO ALTERNATIVO: Streaming usando direttamente ChatOllama.astream()
         
-        Usa questo metodo se ConversationChain.astream() non funziona come aspettato.
+        Il prompt è un unico testo con la cronologia in formato Human/Assistant.
         Gestisce manualmente la memoria conversazionale.
         
         Args:
@@ -178,100 +411,234 @@ RICORDA:
             collection_schema: Schema della collezione MongoDB
             
         Yields:
-            str: Chunks di risposta in tempo reale
+            str: Chunks di risposta in tempo reale (token raggruppati, bufferizzati)
+        """
+        async for chunk in self._stream(thread_id, user_input, collection_schema, self._llm_source):
+            yield chunk
+
+    def _stream(
+        self,
+        thread_id: str,
+        user_input: str,
+        collection_schema: dict,
+        open_source: Callable[..., Tuple[AsyncIterator[Any], Callable[[Any], Any]]]
+    ) -> AsyncGenerator[str, None]:
+        """Pipeline comune: loop di streaming -> raggruppamento token -> buffer"""
+        return _buffer_chunks(_coalesce_chunks(
+            self._stream_impl(thread_id, user_input, collection_schema, open_source),
+            **self._stream_batching
+        ))
+
+    def _messages_source(self, thread_id: str, memory: ConversationBufferMemory, user_input: str, collection_schema: dict):
+        """Sorgente ChatOllama.astream() su messaggi già pronti, senza template da formattare"""
+        messages = [
+            self._system_message,
+            self._schema_message(collection_schema),
+            *memory.chat_memory.messages,
+            HumanMessage(content=user_input),
+        ]
+        return self.llm.astream(messages), operator.attrgetter("content")
+
+    def _llm_source(self, thread_id: str, memory: ConversationBufferMemory, user_input: str, collection_schema: dict):
+        """Sorgente ChatOllama.astream() sul prompt testuale con cronologia"""
+        # Recupera storia conversazione e crea prompt completo manualmente
+        chat_history = memory.load_memory_variables({}).get("chat_history", [])
+        full_prompt = self._create_full_prompt_with_history(
+            thread_id,
+            user_input, 
+            collection_schema, 
+            chat_history
+        )
+        # ChatOllama.astream() produce sempre AIMessageChunk
+        return (
+            self.llm.astream([HumanMessage(content=full_prompt)]),
+            operator.attrgetter("content")
+        )
+
+    async def _stream_impl(
+        self, 
+        thread_id: str, 
+        user_input: str, 
+        collection_schema: dict,
+        open_source: Callable[..., Tuple[AsyncIterator[Any], Callable[[Any], Any]]]
+    ) -> AsyncGenerator[str, None]:
+        """
+        Loop di streaming condiviso: memoria, cache semantica, estrazione dei
+        token dalla sorgente, accumulo, salvataggio e gestione errori
         """
         try:
-            logger.info(f"🔄 Starting alternative streaming for thread {thread_id}")
-            
-            # Setup memoria
-            if thread_id not in self.conversations:
-                self.conversations[thread_id] = ConversationBufferMemory(
-                    memory_key="chat_history",
-                    return_messages=True
+            # Un turno alla volta per thread: memoria e prefisso del prompt
+            # restano coerenti e Ollama riusa la KV cache del turno precedente
+            async with self._thread_lock(thread_id):
+                logger.info("🔄 Starting streaming for thread %s", thread_id)
+                
+                # Setup memoria conversazionale
+                memory = self._get_or_create_memory(thread_id)
+                
+                # Risposta già generata per una richiesta equivalente?
+                cache_key = await self._semantic_cache_key(memory, user_input, collection_schema)
+                cached = self._semantic_cache.lookup(*cache_key) if cache_key else None
+                if cached is not None:
+                    async for chunk in self._replay_cached_response(memory, user_input, cached):
+                        yield chunk
+                    return
+                
+                source, extract_content = open_source(thread_id, memory, user_input, collection_schema)
+                
+                response_parts: List[str] = []
+                chunk_count = 0
+                debug_enabled = logger.isEnabledFor(logging.DEBUG)
+                
+                async for chunk in source:
+                    chunk_count += 1
+                
+                    try:
+                        chunk_content = extract_content(chunk)
+                    except (KeyError, TypeError, AttributeError):
+                        chunk_content = None
+                    if not isinstance(chunk_content, str):
+                        logger.warning("⚠️ Chunk inatteso ignorato: %s", type(chunk).__name__)
+                        continue
+                
+                    if chunk_content:
+                        response_parts.append(chunk_content)
+                        if debug_enabled:
+                            logger.debug("📦 Chunk %d: %d chars", chunk_count, len(chunk_content))
+                        yield chunk_content
+                
+                accumulated_response = "".join(response_parts)
+                # Salva manualmente in memoria dopo streaming
+                memory.save_context(
+                    {"input": user_input},
+                    {"output": accumulated_response}
                 )
-            
-            memory = self.conversations[thread_id]
-            
-            # Recupera storia conversazione
-            chat_history = memory.load_memory_variables({}).get("chat_history", [])
-            
-            # Crea prompt completo manualmente
-            full_prompt = self._create_full_prompt_with_history(
-                user_input, 
-                collection_schema, 
-                chat_history
-            )
-            
-            accumulated_response = ""
-            chunk_count = 0
-            
-            # **STREAMING DIRETTO** tramite ChatOllama.astream()
-            # MODIFICA: Usa astream con prompt text direttamente
-            from langchain.schema import HumanMessage
-            
-            async for chunk in self.llm.astream([HumanMessage(content=full_prompt)]):
-                chunk_count += 1
+                if cache_key and accumulated_response:
+                    self._semantic_cache.store(*cache_key, accumulated_response)
                 
-                # Estrai contenuto dal chunk
-                chunk_content = ""
-                if hasattr(chunk, 'content'):
-                    chunk_content = chunk.content
-                elif hasattr(chunk, 'text'):
-                    chunk_content = chunk.text
-                else:
-                    chunk_content = str(chunk)
+                logger.info("✅ Streaming completato per thread %s: %d chunks, %d caratteri", thread_id, chunk_count, len(accumulated_response))
                 
-                if chunk_content:
-                    accumulated_response += chunk_content
-                    logger.debug(f"📦 Alt chunk {chunk_count}: {len(chunk_content)} chars")
-                    yield chunk_content
-            
-            # Salva manualmente in memoria dopo streaming
-            memory.save_context(
-                {"input": user_input},
-                {"output": accumulated_response}
-            )
-            
-            logger.info(f"✅ Alternative streaming completato: {chunk_count} chunks, {len(accumulated_response)} caratteri")
-            
         except Exception as e:
-            logger.error(f"❌ Errore durante alternative streaming: {e}")
-            yield f"Errore alternative streaming: {str(e)}"
-
-    def _create_intelligent_prompt_template(self, collection_schema: dict):
+            logger.error("❌ Errore durante streaming: %s", e)
+            yield f"Errore durante elaborazione streaming: {str(e)}"
+
+    def share_message_store(
+        self,
+        message_store: Dict[str, BaseChatMessageHistory],
+        threads_in_use: Container[str] = ()
+    ) -> None:
         """
-        Crea template prompt intelligente per ConversationChain
+        Usa la stessa storia messaggi per thread di un altro servizio: i turni
+        di uno sono subito visibili all'altro, senza sincronizzazioni.
         
         Args:
-            collection_schema: Schema della collezione MongoDB
-            
-        Returns:
-            PromptTemplate configurato per MongoDB analytics
+            message_store: Dict thread -> storia messaggi condiviso
+            threads_in_use: Thread attivi nell'altro servizio, la cui storia
+                non va rimossa quando qui la conversazione scade
         """
-        from langchain.prompts import PromptTemplate
-        
-        schema_context = self._format_schema_for_prompt(collection_schema)
-        
-        template = f"""
-{self.system_prompt}
-
-SCHEMA COLLEZIONE MONGODB:
-{schema_context}
-
-CRONOLOGIA CONVERSAZIONE:
-{{chat_history}}
-
-RICHIESTA UTENTE: {{input}}
+        self.message_store = message_store
+        self._store_threads_in_use = threads_in_use
+        self.conversations.clear()
+        self._conversation_last_used.clear()
 
-RISPOSTA:"""
+    def _get_or_create_memory(self, thread_id: str) -> ConversationBufferMemory:
+        """
+        Memoria del thread (creata se assente), segnata come usata di recente.
+        Rimuove le conversazioni oltre il limite o inattive da più del TTL.
+        """
+        now = time.monotonic()
+        memory = self.conversations.get(thread_id)
+        if memory is None:
+            memory = self.conversations[thread_id] = ConversationBufferMemory(
+                chat_memory=self.message_store.setdefault(thread_id, InMemoryChatMessageHistory()),
+                memory_key="chat_history",
+                return_messages=True
+            )
+        else:
+            self.conversations.move_to_end(thread_id)
+        self._conversation_last_used[thread_id] = now
         
-        return PromptTemplate(
-            input_variables=["chat_history", "input"],
-            template=template
-        )
+        # Le meno recenti sono in testa: si scorre finché restano valide
+        expire_before = now - self._conversation_ttl
+        while len(self.conversations) > 1:
+            oldest_id = next(iter(self.conversations))
+            # Thread senza timestamp (aggiunti dall'esterno) partono da ora
+            last_used = self._conversation_last_used.setdefault(oldest_id, now)
+            if len(self.conversations) <= self._max_conversations and last_used >= expire_before:
+                break
+            self.conversations.popitem(last=False)
+            # La storia resta se l'altro servizio usa ancora il thread
+            if oldest_id not in self._store_threads_in_use:
+                self.message_store.pop(oldest_id, None)
+            self._conversation_last_used.pop(oldest_id, None)
+            self._prompt_prefixes.pop(oldest_id, None)
+            logger.debug("🧹 Conversazione rimossa (LRU/TTL): %s", oldest_id)
+        
+        return memory
+
+    def _thread_lock(self, thread_id: str) -> asyncio.Lock:
+        """Lock del thread (creato se assente); vive finché qualcuno lo referenzia"""
+        lock = self._thread_locks.get(thread_id)
+        if lock is None:
+            lock = self._thread_locks[thread_id] = asyncio.Lock()
+        return lock
+
+    async def _semantic_cache_key(
+        self,
+        memory: ConversationBufferMemory,
+        user_input: str,
+        collection_schema: dict
+    ) -> Optional[tuple]:
+        """
+        (scope, embedding) per la cache semantica, o None se non applicabile
+        (cache disattivata, thread con cronologia, embedding non disponibile)
+        """
+        if self._semantic_cache is None or memory.chat_memory.messages:
+            return None
+        try:
+            embedding = await self._embeddings.aembed_query(user_input)
+        except Exception as e:
+            logger.warning("⚠️ Embedding per cache semantica fallito: %s", e)
+            return None
+        scope = hash((self.system_prompt, self._format_schema_for_prompt(collection_schema)))
+        return scope, embedding
+
+    async def _replay_cached_response(
+        self,
+        memory: ConversationBufferMemory,
+        user_input: str,
+        response: str
+    ) -> AsyncGenerator[str, None]:
+        """Ristreamma una risposta in cache in chunk sintetici e la salva in memoria"""
+        for start in range(0, len(response), _CACHED_CHUNK_CHARS):
+            yield response[start:start + _CACHED_CHUNK_CHARS]
+            await asyncio.sleep(0)
+        memory.save_context({"input": user_input}, {"output": response})
+        logger.info("♻️ Risposta servita dalla cache semantica: %d caratteri", len(response))
+
+    @staticmethod
+    def _schema_version(collection_schema: dict) -> str:
+        """Hash stabile dello schema (indipendente dall'ordine delle chiavi)"""
+        schema_json = orjson.dumps(collection_schema, default=str, option=_SCHEMA_JSON_OPTIONS | orjson.OPT_SORT_KEYS)
+        return hashlib.md5(schema_json, usedforsecurity=False).hexdigest()
+
+    def _schema_message(self, collection_schema: dict) -> SystemMessage:
+        """Messaggio schema del prompt, memoizzato per hash dello schema (stesso testo)"""
+        schema_version = self._schema_version(collection_schema)
+        message = self._SCHEMA_MESSAGES.get(schema_version)
+        if message is not None:
+            self._SCHEMA_MESSAGES.move_to_end(schema_version)
+            return message
+        message = self._SCHEMA_MESSAGES[schema_version] = SystemMessage(content=(
+            f"SCHEMA COLLEZIONE MONGODB (versione {schema_version[:8]}):\n"
+            f"{self._format_schema_for_prompt(collection_schema)}"
+        ))
+        if len(self._SCHEMA_MESSAGES) > self._SCHEMA_MESSAGES_MAX:
+            self._SCHEMA_MESSAGES.popitem(last=False)
+        return message
 
     def _create_full_prompt_with_history(
         self, 
+        thread_id: str,
         user_input: str, 
         collection_schema: dict, 
         chat_history: List[BaseMessage]
@@ -279,7 +646,12 @@ RISPOSTA:"""
         """
         Crea prompt completo con schema e storia conversazione
         
+        Il prompt di un turno è il prefisso del prompt del turno successivo
+        (i nuovi messaggi vengono solo appesi), così Ollama riusa la KV cache
+        invece di rielaborare tutta la cronologia.
+        
         Args:
+            thread_id: ID del thread conversazione
             user_input: Input dell'utente
             collection_schema: Schema collezione MongoDB
             chat_history: Lista messaggi conversazione
@@ -287,34 +659,45 @@ RISPOSTA:"""
         Returns:
             str: Prompt completo formattato
         """
-        # Formatta schema
         schema_context = self._format_schema_for_prompt(collection_schema)
         
-        # Formatta storia (ultimi 10 messaggi per non superare context limit)
-        history_context = ""
-        recent_messages = chat_history[-10:] if len(chat_history) > 10 else chat_history
+        prefix = None
+        cached = self._prompt_prefixes.get(thread_id)
+        if cached is not None and cached[0] == schema_context and cached[2] <= len(chat_history):
+            # Appendi solo i messaggi arrivati dall'ultimo turno
+            prefix = cached[1] + "".join(
+                self._format_history_message(message) for message in chat_history[cached[2]:]
+            )
+        if prefix is None or len(prefix) > self._max_prompt_prefix_chars:
+            # Prima richiesta, schema cambiato, memoria pulita o prefisso troppo lungo:
+            # ricostruisci con i messaggi più recenti che stanno in metà budget
+            history_lines: List[str] = []
+            history_chars = 0
+            for message in reversed(chat_history):
+                line = self._format_history_message(message)
+                if history_chars + len(line) > self._max_prompt_prefix_chars // 2:
+                    break
+                history_lines.append(line)
+                history_chars += len(line)
+            
+            prefix = _PROMPT_HEADER.substitute(
+                system=self.system_prompt,
+                schema=schema_context
+            ) + "".join(reversed(history_lines))
         
-        for message in recent_messages:
-            if hasattr(message, 'content') and hasattr(message, 'type'):
-                role = "Human" if message.type == "human" else "Assistant"
-                content = message.content[:500]  # Limit message length
-                history_context += f"{role}: {content}\n"
+        self._prompt_prefixes[thread_id] = (schema_context, prefix, len(chat_history))
         
-        # Prompt completo
-        full_prompt = f"""
-{self.system_prompt}
-
-SCHEMA COLLEZIONE MONGODB:
-{schema_context}
-
-CRONOLOGIA CONVERSAZIONE:
-{history_context}
-
-RICHIESTA UTENTE: {user_input}
-
-RISPOSTA:"""
-        
-        return full_prompt
+        # Nuovo turno nello stesso formato della cronologia: dopo la risposta
+        # questo prompt è esattamente l'inizio del prossimo
+        return f"{prefix}Human: {user_input}\nAssistant:"
+
+    @staticmethod
+    def _format_history_message(message: BaseMessage) -> str:
+        """Riga di cronologia nel prompt; contenuto integro per non alterare il prefisso"""
+        if not (hasattr(message, 'content') and hasattr(message, 'type')):
+            return ""
+        role = "Human" if message.type == "human" else "Assistant"
+        return f"{role}: {message.content}\n"
 
     def _format_schema_for_prompt(self, collection_schema: dict) -> str:
         """
@@ -328,20 +711,8 @@ RISPOSTA:"""
         """
         if not collection_schema:
             return "Schema non disponibile - usa query generiche"
-        
-        schema_lines = []
-        for field, details in collection_schema.items():
-            if isinstance(details, dict):
-                field_type = details.get('type', 'unknown')
-                field_desc = details.get('description', '')
-                line = f"- {field}: {field_type}"
-                if field_desc:
-                    line += f" ({field_desc})"
-                schema_lines.append(line)
-            else:
-                schema_lines.append(f"- {field}: {str(details)}")
-        
-        return "\n".join(schema_lines)
+        # Serializzazione come chiave: lo stesso schema riusa la stessa stringa
+        return _format_schema_cached(orjson.dumps(collection_schema, default=str, option=_SCHEMA_JSON_OPTIONS))
 
     async def get_conversation_memory(self, thread_id: str) -> Optional[ConversationBufferMemory]:
         """
@@ -365,19 +736,83 @@ RISPOSTA:"""
         Returns:
             bool: True se pulito con successo
         """
+        self._prompt_prefixes.pop(thread_id, None)
+        self._conversation_last_used.pop(thread_id, None)
+        self.message_store.pop(thread_id, None)
         if thread_id in self.conversations:
             del self.conversations[thread_id]
-            logger.info(f"🧹 Memoria conversazione pulita per thread: {thread_id}")
+            logger.info("🧹 Memoria conversazione pulita per thread: %s", thread_id)
             return True
         return False
 
     async def health_check(self) -> bool:
         """
-        Verifica stato del servizio streaming
+        Verifica stato del servizio streaming senza generare token:
+        Ollama raggiungibile (GET /api/tags) e modello disponibile
         
         Returns:
             bool: True se servizio disponibile
         """
+        try:
+            response = await self._http_client().get("/api/tags")
+            if response.status_code != 200:
+                logger.error("❌ StreamingService health check failed: HTTP %s", response.status_code)
+                return False
+            
+            # Nomi dei modelli con tag esplicito (gemma3 == gemma3:latest)
+            model = self.model_name if ":" in self.model_name else f"{self.model_name}:latest"
+            available = {m.get("name") for m in response.json().get("models", [])}
+            if model not in available:
+                logger.error("❌ StreamingService health check failed: modello %s non disponibile", model)
+                return False
+            
+            logger.info("✅ StreamingService health check passed")
+            return True
+            
+        except Exception as e:
+            logger.error("❌ StreamingService health check failed: %s", e)
+            return False
+
+    async def warm_up(self) -> bool:
+        """
+        Carica il modello in Ollama e lo tiene in memoria per keep_alive:
+        una richiesta /api/generate senza prompt non genera token
+        
+        Returns:
+            bool: True se il modello è caricato
+        """
+        # Stesso num_ctx delle generazioni: un valore diverso ricaricherebbe il modello
+        payload: Dict[str, Any] = {"model": self.model_name, "options": {"num_ctx": self.num_ctx}}
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        try:
+            # Il caricamento del modello può richiedere decine di secondi
+            response = await self._http_client().post("/api/generate", json=payload, timeout=120.0)
+            if response.status_code != 200:
+                logger.error("❌ Warm-up modello fallito: HTTP %s", response.status_code)
+                return False
+            
+            logger.info("🔥 Modello %s caricato (keep_alive=%s)", self.model_name, self.keep_alive)
+            return True
+            
+        except Exception as e:
+            logger.error("❌ Warm-up modello fallito: %s", e)
+            return False
+
+    def _http_client(self) -> httpx.AsyncClient:
+        """Client HTTP verso le API Ollama (creato al primo uso)"""
+        if self._http is None:
+            self._http = httpx.AsyncClient(base_url=self.base_url, timeout=5.0)
+        return self._http
+
+    async def deep_health_check(self) -> bool:
+        """
+        Verifica completa con una generazione reale (carica il modello):
+        da usare nei test, non nelle probe frequenti
+        
+        Returns:
+            bool: True se il modello risponde
+        """
         try:
             # Test semplice con LLM
             test_prompt = "Test connection"
@@ -387,29 +822,40 @@ RISPOSTA:"""
                 response_received = True
                 break  # Basta il primo chunk per confermare connessione
             
-            logger.info("✅ StreamingService health check passed")
+            logger.info("✅ StreamingService deep health check passed")
             return response_received
             
         except Exception as e:
-            logger.error(f"❌ StreamingService health check failed: {e}")
+            logger.error("❌ StreamingService deep health check failed: %s", e)
             return False
 
-    def get_stats(self) -> dict:
+    async def cleanup(self) -> None:
+        """Chiude le risorse del servizio (client HTTP della health check)"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    def get_stats(self, verbose: bool = False) -> dict:
         """
         Statistiche del servizio streaming
         
+        Args:
+            verbose: Include l'elenco dei thread attivi
+            
         Returns:
             dict: Statistiche correnti
         """
-        return {
+        stats = {
             "service": "StreamingService",
             "model": self.model_name,
             "base_url": self.base_url,
             "active_conversations": len(self.conversations),
-            "conversation_threads": list(self.conversations.keys()),
             "streaming_enabled": True,
             "created_at": datetime.now().isoformat()
         }
+        if verbose:
+            stats["conversation_threads"] = list(self.conversations.keys())
+        return stats
 
 
 # Factory function per facilità d'uso
@@ -481,6 +927,6 @@ if __name__ == "__main__":
             print(f"  📦 {chunk}", end="", flush=True)
         
         print("\n✅ Test completato")
-        print("📊 Stats:", service.get_stats())
+        print("📊 Stats:", service.get_stats(verbose=True))
     
     asyncio.run(test_streaming())
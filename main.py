@@ -10,10 +10,12 @@ FastAPI app principale con:
 import os
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Depends
+from fastapi.responses import ORJSONResponse
 from datetime import datetime
 from typing import Dict, Any, TYPE_CHECKING, Union
 import uuid
 import logging
+import httpx
 from starlette.datastructures import State
 from typing import cast
 from dotenv import load_dotenv
@@ -26,6 +28,7 @@ from langchain_service_stream import StreamingService
 
 # New Guards system
 from guards import GuardrailsMiddleware
+from guards.config import load_config as load_guardrails_config
 
 # Logging setup
 logging.basicConfig(level=logging.INFO)
@@ -42,6 +45,22 @@ DATABASE_NAME = "your_database"
 COLLECTION_NAME = "your_collection"
 OLLAMA_MODEL = os.getenv("LLM_NAME","gemma3:latest")
 OLLAMA_BASE_URL = "http://localhost:11434"
+# Raggruppamento token dello streaming: il primo chunk parte subito, la soglia
+# cresce di STREAM_BATCH_GROWTH fino a 64 caratteri (o 25 ms di attesa)
+STREAM_MIN_BATCH_CHARS = int(os.getenv("STREAM_MIN_BATCH_CHARS", "1"))
+STREAM_BATCH_GROWTH = float(os.getenv("STREAM_BATCH_GROWTH", "2.0"))
+# Pool HTTP dei client Ollama: connessioni keep-alive riusate tra le richieste
+OLLAMA_CLIENT_KWARGS = {
+    "limits": httpx.Limits(max_keepalive_connections=32, max_connections=64, keepalive_expiry=60),
+}
+# Permanenza del modello in memoria Ollama dopo ogni richiesta (default Ollama: 5m).
+# Va passato da entrambi i servizi: ogni richiesta reimposta la scadenza
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "24h")
+# Contesto del modello in token, uguale per entrambi i servizi (un num_ctx
+# diverso tra le richieste fa ricaricare il modello); limita il prompt streaming
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "8192"))
+# Cache semantica delle risposte streaming (0 = disattivata)
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "0"))
 
 # ================================
 # SERVIZI GLOBALI
@@ -81,7 +100,10 @@ async def lifespan(app: FastAPI):
         print("🧠 Inizializzazione ConversationBufferMemory...")
         conversational_service = ConversationalLangChainService(
             model_name=OLLAMA_MODEL,
-            base_url=OLLAMA_BASE_URL
+            base_url=OLLAMA_BASE_URL,
+            client_kwargs=OLLAMA_CLIENT_KWARGS,
+            keep_alive=OLLAMA_KEEP_ALIVE,
+            num_ctx=OLLAMA_NUM_CTX
         )
 
         if await conversational_service.test_connection():
@@ -94,74 +116,45 @@ async def lifespan(app: FastAPI):
         print("🔄 Inizializzazione StreamingService...")
         streaming_service = StreamingService(
             model_name=OLLAMA_MODEL,
-            base_url=OLLAMA_BASE_URL
+            base_url=OLLAMA_BASE_URL,
+            semantic_cache_size=SEMANTIC_CACHE_SIZE,
+            client_kwargs=OLLAMA_CLIENT_KWARGS,
+            stream_min_batch_chars=STREAM_MIN_BATCH_CHARS,
+            stream_batch_growth=STREAM_BATCH_GROWTH,
+            keep_alive=OLLAMA_KEEP_ALIVE,
+            num_ctx=OLLAMA_NUM_CTX
         )
         
-        # **INTEGRAZIONE MEMORIA**: Condividi memory store tra servizi
-        if hasattr(conversational_service, '_conversation_chains'):
-            # Mappa ConversationChain memory to StreamingService memory
-            for thread_id, conversation_chain in conversational_service._conversation_chains.items():
-                if hasattr(conversation_chain, 'memory'):
-                    streaming_service.conversations[thread_id] = conversation_chain.memory
-            print(f"✅ Memoria condivisa: {len(conversational_service._conversation_chains)} conversazioni")
-        
-        # **HOOK SINCRONIZZAZIONE**: Setup cross-service memory sync
-        def setup_memory_sync():
-            """Setup hooks per sincronizzazione automatica memoria tra servizi"""
-            
-            # Patch metodo save_context del ConversationalLangChainService
-            original_get_chain = conversational_service._get_conversation_chain
-            
-            def synced_get_chain(thread_id: str, schema: dict = None):
-                """Wrapper che sincronizza memoria con streaming service"""
-                chain = original_get_chain(thread_id, schema)
-                
-                # Sincronizza memoria con streaming service
-                if hasattr(chain, 'memory') and streaming_service:
-                    streaming_service.conversations[thread_id] = chain.memory
-                
-                return chain
-            
-            # Applica patch
-            conversational_service._get_conversation_chain = synced_get_chain
-            
-            # Patch anche StreamingService per sync inverso
-            original_setup_memory = streaming_service.__class__.__dict__.get('stream_mongodb_query_alternative')
-            if original_setup_memory:
-                async def synced_stream_query(self, thread_id: str, user_input: str, collection_schema: dict):
-                    """Wrapper che sincronizza memoria con conversational service"""
-                    
-                    # Assicurati che la memoria sia sincronizzata
-                    if thread_id in self.conversations and hasattr(conversational_service, '_conversation_chains'):
-                        # Trova o crea conversation chain corrispondente
-                        if thread_id not in conversational_service._conversation_chains:
-                            # Forza creazione chain nel servizio normale
-                            _ = conversational_service._get_conversation_chain(thread_id, collection_schema)
-                    
-                    # Chiama metodo originale
-                    async for chunk in original_setup_memory(self, thread_id, user_input, collection_schema):
-                        yield chunk
-                        
-                        # Sync memoria dopo ogni chunk (per sicurezza)
-                        if thread_id in self.conversations and hasattr(conversational_service, '_conversation_chains'):
-                            if thread_id in conversational_service._conversation_chains:
-                                chain = conversational_service._conversation_chains[thread_id]
-                                if hasattr(chain, 'memory'):
-                                    chain.memory = self.conversations[thread_id]
-                
-                # Applica patch
-                streaming_service.stream_mongodb_query_alternative = synced_stream_query.__get__(streaming_service, streaming_service.__class__)
-            
-            print("✅ Memory sync hooks attivati")
-        
-        # Attiva sincronizzazione
-        setup_memory_sync()
+        # **INTEGRAZIONE MEMORIA**: stessa storia messaggi per thread in entrambi
+        # i servizi (stesso dict), ognuno vede subito i turni dell'altro
+        streaming_service.share_message_store(
+            conversational_service.memory_store,
+            threads_in_use=conversational_service._conversation_chains
+        )
+        conversational_service.share_threads_in_use(streaming_service.conversations)
+        print("✅ Memoria condivisa tra servizi")
         
         if await streaming_service.health_check():
             print("✅ StreamingService operativo e integrato")
         else:
             print("⚠️ StreamingService health check fallito")
 
+        # Modello caricato subito: la prima richiesta non paga il caricamento
+        if await streaming_service.warm_up():
+            print(f"🔥 Modello caricato in memoria (keep_alive={OLLAMA_KEEP_ALIVE})")
+
+        # Servizi agli endpoint una volta sola (niente import main per richiesta)
+        from routes import bind_services
+        bind_services(
+            mongodb_service,
+            conversational_service,
+            streaming_service,
+            load_guardrails_config(),
+            OLLAMA_MODEL,
+            DATABASE_NAME,
+            COLLECTION_NAME
+        )
+
         print("🛡️ AsyncGuard middleware attivo")
         print("🎉 API disponibile: http://localhost:8000")
 
@@ -179,8 +172,7 @@ async def lifespan(app: FastAPI):
         if conversational_service:
             await conversational_service.cleanup()
         if streaming_service:
-            # No explicit cleanup needed for streaming_service since it shares memory
-            pass
+            await streaming_service.cleanup()
         print("👋 Shutdown completato")
     except Exception as e:
         print(f"⚠️ Warning durante shutdown: {e}")
@@ -193,7 +185,9 @@ app = FastAPI(
     title="MongoDB Analytics API con AsyncGuard",
     description="Analytics con ConversationBufferMemory e protezione AsyncGuard streaming",
     version="2.3.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    # Serializzazione risposte con orjson invece di json della stdlib
+    default_response_class=ORJSONResponse
 )
 
 
@@ -225,7 +219,11 @@ if __name__ == "__main__":
             "main:app",
             host="0.0.0.0",
             port=8000,
-            reload=True,
+            # Reload (supervisore + file watcher) solo in sviluppo: DEV=1
+            reload=os.getenv("DEV") == "1",
+            # uvloop e httptools se installati (uvicorn[standard]), altrimenti asyncio/h11
+            loop="auto",
+            http="auto",
             log_level="info",
             lifespan="on",
         )
@@ -8,7 +8,12 @@ Mantiene la tipizzazione forte e la validazione dei dati.
 
 from pydantic import BaseModel, Field
 from typing import Optional, Dict, Literal, Union
-from datetime import datetime
+from datetime import datetime, timezone
+
+
+def _utcnow() -> datetime:
+    """Timestamp UTC con timezone (datetime.utcnow è deprecato)"""
+    return datetime.now(timezone.utc)
 
 
 class StreamingChatRequest(BaseModel):
@@ -140,7 +145,7 @@ class QueryResponse(BaseModel):
         examples=[0, 12]
     )
     created_at: datetime = Field(
-        default_factory=datetime.utcnow,
+        default_factory=_utcnow,
         description="Timestamp esecuzione query (UTC)",
         examples=["2025-09-17T13:45:00Z"]
     )
@@ -161,7 +166,7 @@ class ConversationMessage(BaseModel):
         examples=["Cerca i clienti con più di 30 anni", "Ho trovato 12 documenti"]
     )
     timestamp: datetime = Field(
-        default_factory=datetime.utcnow,
+        default_factory=_utcnow,
         description="Timestamp creazione messaggio (UTC)",
         examples=["2025-09-17T13:45:00Z"]
     )
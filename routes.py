@@ -2,27 +2,102 @@
 routes.py - Endpoint definitions separated from main app for readability.
 This module defines an APIRouter with all API endpoints originally in main.py.
 """
-from fastapi import APIRouter, HTTPException, Depends
-from fastapi.responses import StreamingResponse
-from datetime import datetime
-from typing import Dict, Any, AsyncGenerator
-import uuid
+from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.responses import Response, StreamingResponse
+from datetime import datetime, timezone
+from typing import Dict, Any, AsyncGenerator, Optional, Tuple, Union, TYPE_CHECKING
+from secrets import token_hex
+import asyncio
 import logging
+import time
 import json
+import orjson
 
 from models import QueryRequest, QueryResponse, StreamingChatRequest
 
-# Logger setup consistent with main
-logging.basicConfig(level=logging.INFO)
+if TYPE_CHECKING:
+    from database import MongoDBService
+    from langchain_service import ConversationalLangChainService
+    from langchain_service_stream import StreamingService
+
+# Logging configurato da main; qui solo il logger del modulo
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Servizi e configurazione, assegnati da main all'avvio (bind_services):
+# gli handler li leggono come globali del modulo
+mongodb_service: Optional["MongoDBService"] = None
+conversational_service: Optional["ConversationalLangChainService"] = None
+streaming_service: Optional["StreamingService"] = None
+guardrails_config: Dict[str, Any] = {}
+ollama_model: Optional[str] = None
+database_name: Optional[str] = None
+default_collection: Optional[str] = None
+
+
+# Documenti MongoDB: datetime (naive, in UTC per pymongo) e UUID serializzati
+# nativamente da orjson; default=str resta solo per i tipi BSON (ObjectId annidati, Decimal128)
+_DOCUMENTS_JSON_OPTIONS = orjson.OPT_INDENT_2 | orjson.OPT_NAIVE_UTC
+
+
+def _build_query_response(
+    session_id: str,
+    result: Union[str, Dict[str, Any]],
+    data_saved: bool,
+    file_path: Optional[str],
+    document_count: int
+) -> Response:
+    """
+    Risposta /query nel formato QueryResponse, serializzata una volta con orjson.
+    I campi sono prodotti dal server: niente modello Pydantic intermedio né
+    seconda serializzazione (la validazione resta sulle richieste)
+    """
+    return Response(
+        orjson.dumps({
+            "session_id": session_id,
+            "result": result,
+            "data_saved": data_saved,
+            "file_path": file_path,
+            "document_count": document_count,
+            "created_at": datetime.now(timezone.utc)
+        }, option=orjson.OPT_UTC_Z),
+        media_type="application/json"
+    )
+
+
+def bind_services(
+    mongodb: "MongoDBService",
+    conversational: "ConversationalLangChainService",
+    streaming: Optional["StreamingService"],
+    config: Dict[str, Any],
+    model_name: str,
+    database: str,
+    collection: str
+) -> None:
+    """Rende disponibili agli endpoint i servizi creati nel lifespan di main"""
+    global mongodb_service, conversational_service, streaming_service
+    global guardrails_config, ollama_model, database_name, default_collection
+    global _guardrails_status_body
+    mongodb_service = mongodb
+    conversational_service = conversational
+    streaming_service = streaming
+    guardrails_config = config
+    ollama_model = model_name
+    database_name = database
+    default_collection = collection
+    _guardrails_status_body = _guardrails_status_payload(config)
+
 
 # Dependency for logging requests
-async def log_request_info(request_data: QueryRequest):
+async def log_request_info(request_data: QueryRequest, http_request: Request):
     """Dependency per logging informazioni richiesta"""
-    logger.info(f"Query request: {request_data.query[:50]}{'...' if len(request_data.query) > 50 else ''}")
+    # Se il middleware ha sanificato la query, usa il body validato
+    validated_body = getattr(http_request.state, "validated_body", None)
+    if validated_body is not None:
+        request_data = QueryRequest.model_validate(validated_body)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Query request: %.50s%s", request_data.query, "..." if len(request_data.query) > 50 else "")
     return request_data
 
 
@@ -35,7 +110,7 @@ async def create_new_session():
     """Crea una nuova sessione conversazionale"""
     try:
         # Genera nuovo session_id
-        session_id = f"session_{uuid.uuid4().hex[:8]}"
+        session_id = f"session_{token_hex(4)}"
         
         return {
             "session_id": session_id,
@@ -55,10 +130,8 @@ async def create_new_session():
 async def get_session_info(session_id: str):
     """Ottieni informazioni su una sessione specifica"""
     try:
-        import main  # type: ignore
-        
         # Verifica se la sessione esiste
-        active_threads = await main.conversational_service.list_active_threads()
+        active_threads = await conversational_service.list_active_threads()
         
         if session_id not in active_threads:
             raise HTTPException(
@@ -67,7 +140,7 @@ async def get_session_info(session_id: str):
             )
         
         # Recupera storia conversazione
-        history = await main.conversational_service.get_conversation_history(session_id)
+        history = await conversational_service.get_conversation_history(session_id)
         
         return {
             "session_id": session_id,
@@ -107,13 +180,13 @@ async def streaming_chat(request: StreamingChatRequest = Depends(log_request_inf
         # Se session_id è vuoto: genera nuovo thread (auto-managed)
         if request.session_id:
             thread_id = request.session_id
-            logger.info(f"🔗 Usando session_id fornito: {thread_id}")
+            logger.info("🔗 Usando session_id fornito: %s", thread_id)
         else:
-            thread_id = f"thread_{uuid.uuid4().hex[:8]}"
-            logger.info(f"🆕 Generato nuovo thread_id: {thread_id}")
+            thread_id = f"thread_{token_hex(4)}"
+            logger.info("🆕 Generato nuovo thread_id: %s", thread_id)
         
-        logger.info(f"🔄 Streaming chat - Thread: {thread_id}")
-        logger.info(f"📝 User input: {request.query}")
+        logger.info("🔄 Streaming chat - Thread: %s", thread_id)
+        logger.info("📝 User input: %s", request.query)
         
         # Return streaming response
         return StreamingResponse(
@@ -146,11 +219,8 @@ async def stream_chat_response(thread_id: str, user_query: str, collection: str
         Server-Sent Events formatted strings
     """
     try:
-        # Import main per accesso ai servizi
-        import main  # type: ignore
-        
         # Setup iniziale
-        collection = collection or main.COLLECTION_NAME
+        collection = collection or default_collection
         
         # Yield initial connection event
         yield f'''data: {json.dumps({
@@ -170,19 +240,19 @@ async def stream_chat_response(thread_id: str, user_query: str, collection: str
         # **REAL STREAMING**: Usa servizio streaming globale condiviso
         try:
             # Usa streaming service globale invece di crearne uno nuovo
-            if not main.streaming_service:
+            if not streaming_service:
                 # Fallback se servizio non disponibile
                 raise ImportError("StreamingService globale non disponibile")
             
             # Recupera schema collezione per contesto LLM
-            schema = await main.mongodb_service.get_collection_schema(collection)
-            logger.info(f"📋 Schema caricato per streaming: {len(schema)} campi")
+            schema = await mongodb_service.get_collection_schema(collection)
+            logger.info("📋 Schema caricato per streaming: %d campi", len(schema))
             
             accumulated_content = ""
             chunk_count = 0
             
             # **STREAMING REALE** via StreamingService globale (memoria condivisa)
-            async for chunk in main.streaming_service.stream_mongodb_query_alternative(
+            async for chunk in streaming_service.stream_mongodb_query_alternative(
                 thread_id=thread_id,
                 user_input=user_query,
                 collection_schema=schema
@@ -190,16 +260,16 @@ async def stream_chat_response(thread_id: str, user_query: str, collection: str
                 chunk_count += 1
                 accumulated_content += chunk
                 
-                # Yield content chunk
-                yield f'''data: {json.dumps({
+                # Yield content chunk (un evento per chunk: serializzazione con orjson)
+                yield f'''data: {orjson.dumps({
                     'type': 'content',
                     'thread_id': thread_id,
                     'chunk': chunk,
                     'chunk_index': chunk_count,
                     'accumulated_length': len(accumulated_content)
-                })}\n\n'''
+                }).decode()}\n\n'''
             
-            logger.info(f"✅ Streaming LangChain completato: {chunk_count} chunks")
+            logger.info("✅ Streaming LangChain completato: %d chunks", chunk_count)
             
             # Yield completion event
             yield f'''data: {json.dumps({
@@ -211,7 +281,7 @@ async def stream_chat_response(thread_id: str, user_query: str, collection: str
             })}\n\n'''
             
         except ImportError as import_error:
-            logger.error(f"❌ Impossibile importare StreamingService: {import_error}")
+            logger.error("❌ Impossibile importare StreamingService: %s", import_error)
             
             # **FALLBACK**: Usa mock streaming se servizio non disponibile
             yield f'''data: {json.dumps({
@@ -223,8 +293,8 @@ async def stream_chat_response(thread_id: str, user_query: str, collection: str
             
             # Fallback con servizio normale
             try:
-                schema = await main.mongodb_service.get_collection_schema(collection)
-                result = await main.conversational_service.generate_mongodb_query(
+                schema = await mongodb_service.get_collection_schema(collection)
+                result = await conversational_service.generate_mongodb_query(
                     thread_id=thread_id,
                     user_input=user_query,
                     collection_schema=schema
@@ -242,7 +312,7 @@ async def stream_chat_response(thread_id: str, user_query: str, collection: str
                 })}\n\n'''
                 
             except Exception as fallback_error:
-                logger.error(f"❌ Anche fallback fallito: {fallback_error}")
+                logger.error("❌ Anche fallback fallito: %s", fallback_error)
                 yield f'''data: {json.dumps({
                     'type': 'error',
                     'thread_id': thread_id,
@@ -251,7 +321,7 @@ async def stream_chat_response(thread_id: str, user_query: str, collection: str
                 })}\n\n'''
             
         except Exception as streaming_error:
-            logger.error(f"❌ Errore durante streaming: {streaming_error}")
+            logger.error("❌ Errore durante streaming: %s", streaming_error)
             
             # Yield error event
             yield f'''data: {json.dumps({
@@ -273,10 +343,10 @@ async def stream_chat_response(thread_id: str, user_query: str, collection: str
             'timestamp': datetime.now().isoformat()
         })}\n\n'''
         
-        logger.error(f"Errore globale durante streaming: {e}")
+        logger.error("Errore globale durante streaming: %s", e)
 
 
-@router.post("/query", response_model=QueryResponse)
+@router.post("/query", responses={200: {"model": QueryResponse}})
 async def conversational_query(request: QueryRequest = Depends(log_request_info)):
     """
     Esegue query MongoDB usando ConversationBufferMemory per contesto
@@ -286,58 +356,54 @@ async def conversational_query(request: QueryRequest = Depends(log_request_info)
     - Output: Validazione contenuti tossici, formato JSON
     """
     try:
-        # Local import to avoid circular dependency and access globals defined in main
-        import main  # type: ignore
-
         # **GESTIONE SESSIONI INTELLIGENTE**
         # Se session_id è fornito: usa quello (client-managed)
         # Se session_id è vuoto: genera nuovo thread (auto-managed)
         if request.session_id:
             thread_id = request.session_id
-            logger.info(f"🔗 Usando session_id fornito: {thread_id}")
+            logger.info("🔗 Usando session_id fornito: %s", thread_id)
         else:
-            thread_id = f"thread_{uuid.uuid4().hex[:8]}"
-            logger.info(f"🆕 Generato nuovo thread_id: {thread_id}")
+            thread_id = f"thread_{token_hex(4)}"
+            logger.info("🆕 Generato nuovo thread_id: %s", thread_id)
             
-        collection = request.collection or main.COLLECTION_NAME
+        collection = request.collection or default_collection
 
-        logger.info(f"🔍 Query conversazionale - Thread: {thread_id}")
-        logger.info(f"📝 User input: {request.query}")
+        logger.info("🔍 Query conversazionale - Thread: %s", thread_id)
+        logger.info("📝 User input: %s", request.query)
         
         # **RIMOZIONE DEMO HACK**
         # Non più necessario il thread fisso
 
         # 1. Recupera schema collezione per contesto LLM
-        schema = await main.mongodb_service.get_collection_schema(collection)
-        logger.info(f"📋 Schema caricato: {len(schema)} campi")
+        schema = await mongodb_service.get_collection_schema(collection)
+        logger.info("📋 Schema caricato: %d campi", len(schema))
 
         # 2. Usa ConversationChain con template intelligente
         # Guardrails ha già validato l'input nel middleware
-        intelligent_result = await main.conversational_service.generate_mongodb_query(
+        intelligent_result = await conversational_service.generate_mongodb_query(
             thread_id=thread_id,
             user_input=request.query,
             collection_schema=schema
         )
 
-        logger.info(f"🧠 Risultato template intelligente: {type(intelligent_result)}")
+        logger.info("🧠 Risultato template intelligente: %s", type(intelligent_result))
 
         # 3. Gestisci risposta basata sul tipo
         if intelligent_result.get("_type") == "general_response":
             # È una risposta conversazionale generale
             logger.info("💬 Risposta conversazionale generale")
 
-            return QueryResponse(
+            return _build_query_response(
                 session_id=thread_id,
                 result=intelligent_result["_content"],  # Sarà validato da Guardrails output
                 data_saved=False,
                 file_path=None,
-                document_count=0,
-                created_at=datetime.now()
+                document_count=0
             )
 
         elif intelligent_result:
             # È una query MongoDB valida
-            logger.info(f"🎯 Query MongoDB: {intelligent_result}")
+            logger.info("🎯 Query MongoDB: %s", intelligent_result)
             mongodb_query = intelligent_result
 
         else:
@@ -346,18 +412,19 @@ async def conversational_query(request: QueryRequest = Depends(log_request_info)
             mongodb_query = {}
 
         # 4. Esegui query MongoDB (solo se non è risposta generale)
-        documents = await main.mongodb_service.execute_query(collection, mongodb_query)
+        documents = await mongodb_service.execute_query(collection, mongodb_query)
         doc_count = len(documents)
 
-        logger.info(f"📊 Documenti recuperati: {doc_count}")
+        logger.info("📊 Documenti recuperati: %d", doc_count)
 
-        # 5. Gestione response size (salvataggio file se necessario)
-        response_size_estimate = len(str(documents))
+        # 5. Gestione response size (salvataggio file se necessario):
+        # una sola serializzazione, riusata come risultato se piccola
+        payload = orjson.dumps(documents, default=str, option=_DOCUMENTS_JSON_OPTIONS)
         size_limit = 50000  # 50KB
 
-        if response_size_estimate > size_limit or doc_count > 25:
+        if len(payload) > size_limit or doc_count > 25:
             # Salva risultati grandi su file
-            file_path = await main.conversational_service.save_large_results(
+            file_path = await conversational_service.save_large_results(
                 documents=documents,
                 query_text=request.query,
                 thread_id=thread_id
@@ -374,22 +441,18 @@ async def conversational_query(request: QueryRequest = Depends(log_request_info)
 
         else:
             # Risultati piccoli - mostra direttamente
-            import json
-            result_content = json.dumps(documents, default=str, indent=2)
+            result_content = payload.decode()
             data_saved = False
             file_path = None
 
-        response = QueryResponse(
+        return _build_query_response(
             session_id=thread_id,
             result=result_content,  # Output sarà validato da Guardrails
             data_saved=data_saved,
             file_path=file_path,
-            document_count=doc_count,
-            created_at=datetime.now()
+            document_count=doc_count
         )
 
-        return response
-
     except Exception as e:
         error_msg = f"Errore durante query conversazionale: {str(e)}"
         logger.error(error_msg)
@@ -404,22 +467,27 @@ async def get_conversation_history(thread_id: str):
     🛡️ Protetto da Guardrails: Output validation per contenuti storia
     """
     try:
-        import main  # type: ignore
-        history = await main.conversational_service.get_conversation_history(thread_id)
+        history = await conversational_service.get_conversation_history(thread_id)
 
         # Formatta storia per response
-        formatted_messages = []
-        for msg in history:
-            formatted_messages.append({
+        formatted_messages = [
+            {
                 'type': msg.type,  # 'human' o 'ai'
-                'content': msg.content[:300] + "..." if len(msg.content) > 300 else msg.content,
-                'full_length': len(msg.content)
-            })
+                'content': content[:300] + "..." if (full_length := len(content := msg.content)) > 300 else content,
+                'full_length': full_length
+            }
+            for msg in history
+        ]
+        last_ai_content = next(
+            (entry['content'] for entry in reversed(formatted_messages) if entry['type'] == 'ai'),
+            None
+        )
 
         return {
             'thread_id': thread_id,
             'total_messages': len(history),
-            'conversation_history': formatted_messages,  # Validato da Guardrails
+            'conversation_history': formatted_messages,
+            'last_ai_content': last_ai_content,  # Validato da Guardrails (senza riscansione storia)
             'memory_type': 'ConversationBufferMemory',
             'guardrails_protected': True
         }
@@ -439,8 +507,7 @@ async def get_conversation_history(thread_id: str):
 async def list_active_conversations():
     """Lista conversazioni attive (non protetto da Guardrails)"""
     try:
-        import main  # type: ignore
-        active_threads = await main.conversational_service.list_active_threads()
+        active_threads = await conversational_service.list_active_threads()
 
         return {
             'active_threads': active_threads,
@@ -459,8 +526,10 @@ async def clear_conversation_memory(thread_id: str):
     Cancella ConversationBufferMemory per thread specifico
     """
     try:
-        import main  # type: ignore
-        cleared = await main.conversational_service.clear_conversation_memory(thread_id)
+        cleared = await conversational_service.clear_conversation_memory(thread_id)
+        # Storia condivisa: rimuovi anche memoria e prefisso prompt dello streaming
+        if streaming_service is not None:
+            cleared = await streaming_service.clear_conversation_memory(thread_id) or cleared
 
         return {
             'thread_id': thread_id,
@@ -473,44 +542,61 @@ async def clear_conversation_memory(thread_id: str):
         raise HTTPException(status_code=500, detail=f"Errore clear: {str(e)}")
 
 
+# Ultima risposta di /health: le probe frequenti la riusano per _HEALTH_CACHE_TTL secondi
+_HEALTH_CACHE_TTL = 1.0
+_health_cache: Tuple[float, Optional[Dict[str, Any]]] = (0.0, None)
+
+# Parti statiche della risposta /health, condivise tra le chiamate (sola lettura)
+_SERVICE_OK = '✅ Healthy'
+_SERVICE_ISSUES = '❌ Issues'
+_GUARDRAILS_ACTIVE = '✅ Active'
+_HEALTH_PROTECTION = {
+    'guardrails_middleware': True,
+    'input_validation': ['PII_detection', 'toxicity_filter', 'injection_protection'],
+    'output_validation': ['content_filter', 'JSON_validation', 'toxicity_filter']
+}
+
+
 @router.get("/health")
 async def health_check():
     """Health check con info memoria e Guardrails"""
-    try:
-        import main  # type: ignore
-        # Test servizi
-        mongo_healthy = await main.mongodb_service.health_check()
-        llm_healthy = await main.conversational_service.health_check()
+    global _health_cache
+    cached_at, cached = _health_cache
+    if cached is not None and time.monotonic() - cached_at < _HEALTH_CACHE_TTL:
+        return cached
 
-        # Info memoria
-        active_conversations = await main.conversational_service.list_active_threads()
+    try:
+        # Test servizi e info memoria, indipendenti: in parallelo
+        mongo_healthy, llm_healthy, active_conversations = await asyncio.gather(
+            mongodb_service.health_check(),
+            conversational_service.health_check(),
+            conversational_service.list_active_threads()
+        )
 
         overall_status = 'healthy' if (mongo_healthy and llm_healthy) else 'degraded'
 
-        return {
+        health = {
             'status': overall_status,
             'timestamp': datetime.now().isoformat(),
             'services': {
-                'mongodb': '✅ Healthy' if mongo_healthy else '❌ Issues',
-                'ollama_llm': '✅ Healthy' if llm_healthy else '❌ Issues',
-                'guardrails': '✅ Active'
+                'mongodb': _SERVICE_OK if mongo_healthy else _SERVICE_ISSUES,
+                'ollama_llm': _SERVICE_OK if llm_healthy else _SERVICE_ISSUES,
+                'guardrails': _GUARDRAILS_ACTIVE
             },
             'memory': {
                 'type': 'ConversationBufferMemory',
                 'active_conversations': len(active_conversations),
-                'threads': active_conversations[:5] if len(active_conversations) > 5 else active_conversations
-            },
-            'protection': {
-                'guardrails_middleware': True,
-                'input_validation': ['PII_detection', 'toxicity_filter', 'injection_protection'],
-                'output_validation': ['content_filter', 'JSON_validation', 'toxicity_filter']
+                'threads': active_conversations[:5]
             },
+            'protection': _HEALTH_PROTECTION,
             'config': {
-                'ollama_model': main.OLLAMA_MODEL,
-                'database': main.DATABASE_NAME,
-                'default_collection': main.COLLECTION_NAME
+                'ollama_model': ollama_model,
+                'database': database_name,
+                'default_collection': default_collection
             }
         }
+        _health_cache = (time.monotonic(), health)
+        return health
 
     except Exception as e:
         raise HTTPException(
@@ -519,58 +605,63 @@ async def health_check():
         )
 
 
+def _guardrails_status_payload(config: Dict[str, Any]) -> bytes:
+    """Corpo JSON di /guardrails/status: dipende solo dalla configurazione"""
+    return orjson.dumps({
+        'guardrails_active': True,
+        'protected_endpoints': ['/query', '/conversation/{thread_id}/history'],
+        'input_validators': [
+            'ToxicLanguage',
+            'ProfanityFree',
+            'DetectPII'
+        ],
+        'output_validators': [
+            'ToxicLanguage',
+            'ProfanityFree',
+            'NoInvalidJSON'
+        ],
+        'config': config
+    }, default=str)
+
+
+# Serializzato una volta (ricalcolato da bind_services con la configurazione attiva)
+_guardrails_status_body = _guardrails_status_payload(guardrails_config)
+
+
 @router.get("/guardrails/status")
 async def guardrails_status():
     """Endpoint per monitorare stato Guardrails"""
-    try:
-        import main  # type: ignore
-        return {
-            'guardrails_active': True,
-            'protected_endpoints': ['/query', '/conversation/{thread_id}/history'],
-            'input_validators': [
-                'ToxicLanguage',
-                'ProfanityFree',
-                'DetectPII'
-            ],
-            'output_validators': [
-                'ToxicLanguage',
-                'ProfanityFree',
-                'NoInvalidJSON'
-            ],
-            'config': main.GUARDRAILS_CONFIG
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return Response(_guardrails_status_body, media_type="application/json")
+
+
+# Contenuto statico: serializzato una volta all'import
+_ROOT_BODY = orjson.dumps({
+    'name': 'MongoDB Analytics API con Guardrails',
+    'version': '2.2.0',
+    'memory_approach': 'ConversationBufferMemory',
+    'protection': 'Guardrails Input/Output Validation',
+    'description': 'API per analytics MongoDB con memoria conversazionale protetta',
+    'endpoints': {
+        'query': 'POST /query - Esegui query conversazionale [PROTETTO]',
+        'history': 'GET /conversation/{thread_id}/history - Storia thread [PROTETTO]',
+        'conversations': 'GET /conversations - Lista thread attivi',
+        'clear': 'DELETE /conversation/{thread_id} - Pulisci memoria',
+        'health': 'GET /health - Status servizi + Guardrails',
+        'guardrails': 'GET /guardrails/status - Stato protezioni',
+        'docs': 'GET /docs - Documentazione OpenAPI'
+    },
+    'security_features': [
+        'PII Detection & Blocking',
+        'Toxic Content Filtering',
+        'SQL/NoSQL Injection Protection',
+        'Profanity Filtering',
+        'Output Content Validation',
+        'JSON Format Validation'
+    ]
+})
 
 
 @router.get("/")
 async def root():
     """Root endpoint con info API e Guardrails"""
-    try:
-        import main  # type: ignore
-        return {
-            'name': 'MongoDB Analytics API con Guardrails',
-            'version': '2.2.0',
-            'memory_approach': 'ConversationBufferMemory',
-            'protection': 'Guardrails Input/Output Validation',
-            'description': 'API per analytics MongoDB con memoria conversazionale protetta',
-            'endpoints': {
-                'query': 'POST /query - Esegui query conversazionale [PROTETTO]',
-                'history': 'GET /conversation/{thread_id}/history - Storia thread [PROTETTO]',
-                'conversations': 'GET /conversations - Lista thread attivi',
-                'clear': 'DELETE /conversation/{thread_id} - Pulisci memoria',
-                'health': 'GET /health - Status servizi + Guardrails',
-                'guardrails': 'GET /guardrails/status - Stato protezioni',
-                'docs': 'GET /docs - Documentazione OpenAPI'
-            },
-            'security_features': [
-                'PII Detection & Blocking',
-                'Toxic Content Filtering',
-                'SQL/NoSQL Injection Protection',
-                'Profanity Filtering',
-                'Output Content Validation',
-                'JSON Format Validation'
-            ]
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return Response(_ROOT_BODY, media_type="application/json")
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Test violation messages - keyword oltre i primi 128 caratteri
+==============================================================
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(__file__))
+
+from guards.config import DEFAULT_CONFIG
+from guards.messages import ERROR_SPAN_CHARS, error_span, get_violation_message
+from guards.middleware import _VIOLATION_RE
+
+GENERIC_MESSAGE = "Validazione fallita. Riprova con contenuto diverso."
+
+def _violation_type(error_msg: str) -> set:
+    """Tipi di violazione trovati dal middleware sullo stesso span"""
+    return {m.lastgroup for m in _VIOLATION_RE.finditer(error_span(error_msg))}
+
+def test_keyword_after_128_chars():
+    """Keyword PII dopo 128 caratteri: messaggio specifico e violation_type coerenti"""
+    error_msg = "Validation failed for field with errors: " + "x" * 200 + " Rilevati dati personali sensibili: email"
+
+    message = get_violation_message(error_msg, DEFAULT_CONFIG)
+    print(f"📄 Messaggio: {message}")
+    assert message == DEFAULT_CONFIG["custom_messages"]["pii"]
+    assert _violation_type(error_msg) == {"pii_violation"}
+
+def test_keyword_outside_span():
+    """Keyword oltre lo span: messaggio generico e nessun violation_type specifico"""
+    error_msg = "x" * ERROR_SPAN_CHARS + " Rilevati dati personali sensibili: email"
+
+    assert get_violation_message(error_msg, DEFAULT_CONFIG) == GENERIC_MESSAGE
+    assert _violation_type(error_msg) == set()
+
+if __name__ == "__main__":
+    print("🧪 Testing violation messages...")
+    test_keyword_after_128_chars()
+    test_keyword_outside_span()
+    print("\n🎉 Violation message tests completed!")